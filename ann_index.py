@@ -0,0 +1,116 @@
+# ann_index.py
+# ------------------------------------------------------------------
+# Inverted-file (IVF) approximate nearest-neighbour index over NumPy
+# ------------------------------------------------------------------
+
+import os
+import math
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+# ───────────────  IVF settings  ───────────────
+ANN_MIN_ROWS = int(os.getenv("ANN_MIN_ROWS", "5000"))        # smaller datasets use the exact scan
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))               # lists scanned per query
+ANN_KMEANS_ITERS = 10
+ANN_TRAIN_PER_LIST = 40                                      # k-means training rows per list
+ANN_ASSIGN_BATCH = 8192
+
+
+def default_nlist(n: int) -> int:
+    return max(1, int(round(4 * math.sqrt(n))))
+
+
+def _nearest_centroid(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assign = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], ANN_ASSIGN_BATCH):
+        block = np.asarray(vectors[start:start + ANN_ASSIGN_BATCH], dtype=np.float32)
+        assign[start:start + block.shape[0]] = np.argmax(block @ centroids.T, axis=1)
+    return assign
+
+
+class IVFIndex:
+    """
+    Spherical k-means coarse quantizer over unit-normalized rows.
+
+    The matrix it serves must be stored in list order (see `build`), so every
+    inverted list is a contiguous row range `offsets[i]:offsets[i + 1]` and a
+    query scans `nprobe` slices without gathering or copying rows.
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, nprobe: int = ANN_NPROBE):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.nprobe = nprobe
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.centroids.nbytes + self.offsets.nbytes
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, nlist: Optional[int] = None,
+              seed: int = 0) -> Tuple["IVFIndex", np.ndarray]:
+        """
+        Train on a sample and assign every row to its nearest list.
+
+        Returns (index, order): `vectors[order]` (and the matching prompts and
+        answers) is the list-ordered layout the index expects. Seeded, so
+        workers building the same dataset agree on the layout.
+        """
+        n = vectors.shape[0]
+        nlist = min(nlist or default_nlist(n), n)
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, nlist * ANN_TRAIN_PER_LIST)
+        sample = np.asarray(vectors[np.sort(rng.choice(n, sample_size, replace=False))], dtype=np.float32)
+
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(ANN_KMEANS_ITERS):
+            assign = _nearest_centroid(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            # Empty lists keep their previous centroid
+            centroids[~empty] = sums[~empty] / norms[~empty]
+
+        assign = _nearest_centroid(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=nlist), out=offsets[1:])
+        return cls(centroids, offsets), order
+
+    def search(self, score_slice: Callable[[int, int], np.ndarray], q_unit: np.ndarray, k: int = 1,
+               nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k over the `nprobe` lists closest to the query; (rows, scores) best first.
+
+        `score_slice(start, end)` returns the query's similarity to rows start:end
+        of the list-ordered matrix, so the caller decides how rows are stored.
+        """
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        centroid_sims = self.centroids @ q_unit
+        if nprobe < self.nlist:
+            probes = np.argpartition(centroid_sims, -nprobe)[-nprobe:]
+        else:
+            probes = np.arange(self.nlist)
+
+        rows, sims = [], []
+        for p in probes:
+            start, end = self.offsets[p], self.offsets[p + 1]
+            if start == end:
+                continue
+            rows.append(np.arange(start, end))
+            sims.append(score_slice(start, end))
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows = np.concatenate(rows)
+        sims = np.concatenate(sims)
+
+        k = min(k, sims.shape[0])
+        top = np.argpartition(sims, -k)[-k:] if k < sims.shape[0] else np.arange(sims.shape[0])
+        top = top[np.argsort(sims[top])[::-1]]
+        return rows[top], sims[top]
@@ -4,6 +4,11 @@
 # ------------------------------------------------------------------
 
 import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
 from passlib.context import CryptContext
@@ -15,8 +20,17 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "super-secret-change-me")
 ALGORITHM  = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30             
+# How long a verified token skips the admin lookup; also how long a password
+# change made on another worker can take to revoke tokens here
+ADMIN_PRINCIPAL_TTL_S = float(os.getenv("ADMIN_PRINCIPAL_TTL_S", "30"))
+ADMIN_PRINCIPAL_CACHE_SIZE = 1024
 
 # ─────────────  password hasher  ──────────────
+# bcrypt runs on its own small pool so a login burst cannot take over the
+# threadpool that sync endpoints share
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+AUTH_HASH_MAX_QUEUE = int(os.getenv("AUTH_HASH_MAX_QUEUE", "32"))      # waiting jobs before 503
+
 _pwd = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def hash_password(password: str) -> str:
@@ -27,6 +41,147 @@ def verify_password(plain: str, hashed: str) -> bool:
     """Return True if plain password matches hashed one."""
     return _pwd.verify(plain, hashed)
 
+
+class PasswordHasherBusy(RuntimeError):
+    """The hashing queue is full; the caller should retry shortly."""
+
+
+class PasswordHasher:
+    """
+    Bounded executor for bcrypt work, with queue-depth counters.
+
+    At most `workers` hashes run at once and at most `max_queue` more wait;
+    beyond that `PasswordHasherBusy` is raised instead of queueing unboundedly.
+    """
+
+    def __init__(self, workers: int = AUTH_HASH_WORKERS, max_queue: int = AUTH_HASH_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self.pending = 0                  # submitted and not finished (running + queued)
+        self.max_queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self._wait_s_total = 0.0
+        self._run_s_total = 0.0
+
+    def _timed(self, submitted_at: float, fn, *args):
+        started_at = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            finished_at = time.perf_counter()
+            with self._lock:
+                self._wait_s_total += started_at - submitted_at
+                self._run_s_total += finished_at - started_at
+
+    async def run(self, fn, *args):
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusy("Too many password checks in progress")
+        self.pending += 1
+        self.max_queued = max(self.max_queued, self.pending - self.workers)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._timed, time.perf_counter(), fn, *args
+            )
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            wait_s, run_s = self._wait_s_total, self._run_s_total
+        done = max(self.completed, 1)
+        return {
+            "workers": self.workers,
+            "in_flight": min(self.pending, self.workers),
+            "queued": max(self.pending - self.workers, 0),
+            "max_queued": self.max_queued,
+            "queue_limit": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(wait_s / done * 1000, 2),
+            "avg_hash_ms": round(run_s / done * 1000, 2),
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHasher()
+
+async def hash_password_async(password: str) -> str:
+    """hash_password on the bounded bcrypt pool."""
+    return await password_hasher.run(hash_password, password)
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    """verify_password on the bounded bcrypt pool."""
+    return await password_hasher.run(verify_password, plain, hashed)
+
+
+# ─────────────  attempt throttling  ───────────
+LOGIN_WINDOW_S = float(os.getenv("LOGIN_WINDOW_S", "60"))
+# Both count failed attempts only, so admins sharing one address (e.g. behind a
+# reverse proxy, where the peer is the proxy) are never locked out by each
+# other's successful logins
+LOGIN_FAILURES_PER_IP = int(os.getenv("LOGIN_FAILURES_PER_IP", "20"))
+LOGIN_FAILURES_PER_EMAIL = int(os.getenv("LOGIN_FAILURES_PER_EMAIL", "5"))
+_THROTTLE_SWEEP_KEYS = 10_000
+
+
+class AttemptThrottle:
+    """
+    Sliding-window counter: at most `limit` hits per key in `window_s` seconds.
+
+    Used from the event loop only, so it takes no locks.
+    """
+
+    def __init__(self, limit: int, window_s: float = LOGIN_WINDOW_S):
+        self.limit = limit
+        self.window_s = window_s
+        self._hits: dict[str, deque] = {}
+        self.throttled = 0
+
+    def _recent(self, key: str, now: float) -> deque | None:
+        hits = self._hits.get(key)
+        if hits is None:
+            return None
+        while hits and hits[0] <= now - self.window_s:
+            hits.popleft()
+        if not hits:
+            del self._hits[key]
+            return None
+        return hits
+
+    def retry_after(self, key: str) -> float:
+        """Seconds until `key` may try again; 0 when it is not throttled."""
+        now = time.monotonic()
+        hits = self._recent(key, now)
+        if hits is None or len(hits) < self.limit:
+            return 0.0
+        self.throttled += 1
+        return hits[0] + self.window_s - now
+
+    def hit(self, key: str) -> None:
+        now = time.monotonic()
+        if len(self._hits) > _THROTTLE_SWEEP_KEYS:
+            for stale in list(self._hits):
+                self._recent(stale, now)
+        self._hits.setdefault(key, deque()).append(now)
+
+    def reset(self, key: str) -> None:
+        self._hits.pop(key, None)
+
+    def metrics(self) -> dict:
+        return {"limit": self.limit, "window_s": self.window_s,
+                "tracked_keys": len(self._hits), "throttled": self.throttled}
+
+
+ip_throttle = AttemptThrottle(LOGIN_FAILURES_PER_IP)
+email_throttle = AttemptThrottle(LOGIN_FAILURES_PER_EMAIL)
+
 # ────────────────  JWT helpers  ───────────────
 def create_access_token(data: dict, *, minutes: int = ACCESS_TOKEN_EXPIRE_MINUTES) -> str:
     """
@@ -46,3 +201,48 @@ def decode_token(token: str) -> dict | None:
         return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         return None
+
+# ──────────  verified-principal cache  ─────────
+class PrincipalCache:
+    """
+    Admin records for recently verified tokens, so authenticated requests skip
+    the JWT decode and the admin lookup.
+
+    Entries expire after `ttl` seconds or at the token's own `exp`, whichever
+    is first. Thread-safe: sync endpoints resolve their admin in the threadpool.
+    """
+
+    def __init__(self, ttl: float = ADMIN_PRINCIPAL_TTL_S, max_size: int = ADMIN_PRINCIPAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[token]
+                return None
+            return entry[1]
+
+    def put(self, token: str, admin: dict, exp: float | None = None) -> None:
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        with self._lock:
+            self._entries[token] = (expires_at, admin)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, email: str) -> None:
+        """Forget every cached token for this admin (e.g. after a password change)."""
+        with self._lock:
+            for token in [t for t, (_, admin) in self._entries.items() if admin["email"] == email]:
+                del self._entries[token]
+
+
+admin_principals = PrincipalCache()
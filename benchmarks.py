@@ -0,0 +1,167 @@
+# benchmarks.py
+# ------------------------------------------------------------------
+# Standalone micro-benchmarks for hot paths; not imported by the app.
+#   python benchmarks.py [name ...]   (no names = run all)
+# ------------------------------------------------------------------
+
+import os
+import re
+import sys
+import json
+import time
+
+import numpy as np
+
+from file_embaded import EmbeddingIndex
+from sqlite_utils import RECRUITING_KEYWORDS, detect_recruiting_inquiry
+
+DATASET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chatbot_training_dataset_tpg_full.json")
+
+
+# ───────────────  recruiting detection  ───────────────
+
+def _legacy_detect_recruiting_inquiry(message: str) -> bool:
+    """Original per-call implementation, kept as the reference for the benchmark below."""
+    message_lower = message.lower().strip()
+    for keyword in RECRUITING_KEYWORDS:
+        if keyword in message_lower:
+            return True
+    recruiting_patterns = [
+        r'\b(job|work|position|career|opportunity|hiring)\b.*\b(insurance|sales|agent)\b',
+        r'\b(insurance|sales|agent)\b.*\b(job|work|position|career|opportunity)\b',
+        r'\blicensed?\b.*\b(insurance|life insurance|agent)\b',
+        r'\bget licensed\b',
+        r'\bjoin.*team\b',
+        r'\bwork.*with.*you\b',
+        r'\bhiring.*agents?\b',
+        r'\bagent.*position\b',
+        r'\bsales.*opportunity\b'
+    ]
+    for pattern in recruiting_patterns:
+        if re.search(pattern, message_lower):
+            return True
+    return False
+
+
+def benchmark_recruiting_detection(dataset_path: str = DATASET_PATH, rounds: int = 2000):
+    """Compares per-message cost of the compiled matcher against the original implementation."""
+    with open(dataset_path, encoding="utf-8") as f:
+        messages = [row["user_input"] for row in json.load(f)]
+    messages += ["Are you hiring agents?", "I want to join your team", "Is this for agents?"]
+
+    mismatches = [m for m in messages if _legacy_detect_recruiting_inquiry(m) != detect_recruiting_inquiry(m)]
+    if mismatches:
+        raise AssertionError(f"Matcher disagrees with legacy implementation on: {mismatches[:5]}")
+
+    for label, fn in (("legacy", _legacy_detect_recruiting_inquiry), ("compiled", detect_recruiting_inquiry)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for msg in messages:
+                fn(msg)
+        per_msg_us = (time.perf_counter() - start) / (rounds * len(messages)) * 1e6
+        print(f"{label:>8}: {per_msg_us:.2f} µs/message over {len(messages)} prompts x {rounds} rounds")
+
+
+# ───────────────  FAQ vector search  ───────────────
+
+def benchmark_search(sizes=(1_000, 10_000, 100_000), dim: int = 1536, queries: int = 50, k: int = 5):
+    """Per-query cost of the old full-norm argmax scan vs. the pre-normalized top-k search."""
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        raw = rng.standard_normal((n, dim), dtype=np.float32)
+        index = EmbeddingIndex(f"bench-{n}", raw, [""] * n, [""] * n)
+        qs = rng.standard_normal((queries, dim), dtype=np.float32)
+
+        start = time.perf_counter()
+        for q in qs:
+            sims = raw @ q / (np.linalg.norm(raw, axis=1) * np.linalg.norm(q))
+            int(np.argmax(sims))
+        legacy_ms = (time.perf_counter() - start) / queries * 1000
+
+        start = time.perf_counter()
+        for q in qs:
+            index.search(q, k)
+        topk_ms = (time.perf_counter() - start) / queries * 1000
+
+        print(f"{n:>7} rows x {dim}d: legacy argmax {legacy_ms:8.3f} ms/query | "
+              f"normalized top-{k} {topk_ms:8.3f} ms/query")
+        del raw, index
+
+
+def benchmark_ann(sizes=(10_000, 100_000), dim: int = 1536, queries: int = 200, k: int = 5,
+                  nprobes=(4, 8, 16, 32)):
+    """
+    Recall@k and latency of the IVF search against the exact scan.
+
+    Rows are drawn around random topic centres (FAQ datasets are clustered by
+    topic) and queries are perturbed copies of stored rows, like rephrased questions.
+    """
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        centres = rng.standard_normal((max(1, n // 50), dim), dtype=np.float32)
+        raw = centres[rng.integers(0, centres.shape[0], n)]
+        raw += 1.0 * rng.standard_normal((n, dim), dtype=np.float32)
+        exact_index = EmbeddingIndex(f"bench-{n}", raw, [""] * n, [""] * n)
+        del raw
+
+        start = time.perf_counter()
+        ivf_index = exact_index.build_ivf()
+        build_s = time.perf_counter() - start
+
+        qs = ivf_index.vectors[rng.integers(0, n, queries)]
+        qs = qs + 0.02 * rng.standard_normal(qs.shape, dtype=np.float32)
+
+        start = time.perf_counter()
+        truth = [set(ivf_index.search(q, k, exact=True)[0].tolist()) for q in qs]
+        exact_ms = (time.perf_counter() - start) / queries * 1000
+        print(f"{n:>7} rows x {dim}d: exact {exact_ms:8.3f} ms/query | "
+              f"IVF nlist={ivf_index.ivf.nlist} built in {build_s:.1f}s")
+
+        for nprobe in nprobes:
+            ivf_index.ivf.nprobe = nprobe
+            start = time.perf_counter()
+            found = [set(ivf_index.search(q, k)[0].tolist()) for q in qs]
+            ivf_ms = (time.perf_counter() - start) / queries * 1000
+            recall = sum(len(f & t) for f, t in zip(found, truth)) / sum(len(t) for t in truth)
+            print(f"          nprobe={nprobe:<3} {ivf_ms:8.3f} ms/query | recall@{k} {recall:.3f}")
+        del exact_index, ivf_index
+
+
+def benchmark_quantization(n: int = 100_000, dim: int = 1536, queries: int = 200, k: int = 5):
+    """Memory scanned per query, recall@k against float32 and latency for each storage mode."""
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((max(1, n // 50), dim), dtype=np.float32)
+    raw = centres[rng.integers(0, centres.shape[0], n)]
+    raw += 1.0 * rng.standard_normal((n, dim), dtype=np.float32)
+    base = EmbeddingIndex(f"bench-{n}", raw, [""] * n, [""] * n).build_ivf()
+    del raw
+    qs = base.vectors[rng.integers(0, n, queries)]
+    qs = qs + 0.02 * rng.standard_normal(qs.shape, dtype=np.float32)
+    truth = [set(base.search(q, k, exact=True)[0].tolist()) for q in qs]
+
+    for mode in ("none", "float16", "int8"):
+        index = EmbeddingIndex(base.key, base.vectors, base.answers, base.prompts, normalized=True, ivf=base.ivf)
+        if mode != "none":
+            index.quantize(mode)
+        line = f"{mode:>7}: {index.nbytes / 2**20:7.1f} MB scanned"
+        for label, exact in (("exact", True), ("IVF", False)):
+            start = time.perf_counter()
+            found = [set(index.search(q, k, exact=exact)[0].tolist()) for q in qs]
+            ms = (time.perf_counter() - start) / queries * 1000
+            recall = sum(len(f & t) for f, t in zip(found, truth)) / sum(len(t) for t in truth)
+            line += f" | {label} {ms:7.3f} ms recall@{k} {recall:.3f}"
+        print(line)
+
+
+BENCHMARKS = {
+    "recruiting": benchmark_recruiting_detection,
+    "search": benchmark_search,
+    "ann": benchmark_ann,
+    "quantization": benchmark_quantization,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f"── {name} ──")
+        BENCHMARKS[name]()
@@ -0,0 +1,127 @@
+# chat_sessions.py
+# ------------------------------------------------------------------
+# In-memory lead state for WebSocket chat connections, persisted by
+# a per-session background writer
+# ------------------------------------------------------------------
+
+import asyncio
+import traceback
+from typing import Dict, Optional
+
+from schemas import Lead
+from sqlite_utils import get_lead_from_db, save_lead_to_db
+
+# ───────────────  writer settings  ───────────────
+SESSION_SAVE_RETRY_S = 1.0           # pause before retrying a failed background save
+
+
+class ChatSession:
+    """
+    One user's lead, kept in memory while at least one WebSocket is open for it.
+
+    The lead is read from SQLite once, on the first turn. `save()` only marks it
+    dirty; a writer task persists it in the background, so a turn never waits on
+    the database. Saves that pile up while a write is running are coalesced into
+    one: save_lead_to_db writes the lead row plus every message not stored yet.
+    """
+
+    def __init__(self, user_id: str, history_limit: Optional[int] = None):
+        self.user_id = user_id
+        self.history_limit = history_limit
+        self.lead: Optional[Lead] = None
+        self.lock = asyncio.Lock()            # one turn at a time, even across tabs
+        self.connections = 0
+        self._loaded = False
+        self._pending = False
+        self._closing = False
+        self._wake = asyncio.Event()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def load(self) -> Optional[Lead]:
+        if not self._loaded:
+            self.lead = await get_lead_from_db(self.user_id, history_limit=self.history_limit)
+            self._loaded = True
+        elif self.lead is not None:
+            self._trim_history()
+        return self.lead
+
+    async def save(self, lead: Lead) -> None:
+        self.lead = lead
+        self._pending = True
+        self._wake.set()
+
+    def _trim_history(self) -> None:
+        # Same window /chat loads per turn; only messages already stored are dropped
+        if not self.history_limit:
+            return
+        lead = self.lead
+        excess = min(len(lead.conversation_history) - self.history_limit,
+                     lead._persisted_seq - lead._history_offset)
+        if excess > 0:
+            del lead.conversation_history[:excess]
+            lead._history_offset += excess
+
+    async def _write_loop(self) -> None:
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            if self._pending:
+                self._pending = False
+                await self._write()
+            if self._closing and not self._pending:
+                return
+
+    async def _write(self) -> None:
+        lead = self.lead
+        # Save a copy: the next turn may append to the live history mid-write
+        snapshot = lead.model_copy(update={"conversation_history": list(lead.conversation_history)})
+        try:
+            await save_lead_to_db(snapshot)
+        except Exception as e:
+            traceback.print_exc()
+            if self._closing:
+                print(f"WARNING: Final save for session {self.user_id} failed; latest turn not stored: {e}")
+                return
+            print(f"WARNING: Background save for session {self.user_id} failed; retrying: {e}")
+            await asyncio.sleep(SESSION_SAVE_RETRY_S)
+            self._pending = True
+            self._wake.set()
+            return
+        lead._persisted_seq = snapshot._persisted_seq
+        if snapshot.is_recruiting_inquiry:
+            lead.is_recruiting_inquiry = True
+
+    async def close(self) -> None:
+        """Flush the last pending save and stop the writer."""
+        self._closing = True
+        self._wake.set()
+        await self._writer
+
+
+class ChatSessionRegistry:
+    """Sessions by user id, shared by every connection open for the same user in this worker."""
+
+    def __init__(self, history_limit: Optional[int] = None):
+        self.history_limit = history_limit
+        self._sessions: Dict[str, ChatSession] = {}
+
+    def acquire(self, user_id: str) -> ChatSession:
+        session = self._sessions.get(user_id)
+        if session is None:
+            session = self._sessions[user_id] = ChatSession(user_id, self.history_limit)
+        session.connections += 1
+        return session
+
+    async def release(self, session: ChatSession) -> None:
+        session.connections -= 1
+        if session.connections == 0 and self._sessions.get(session.user_id) is session:
+            del self._sessions[session.user_id]
+            await session.close()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    async def close_all(self) -> None:
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        await asyncio.gather(*(session.close() for session in sessions), return_exceptions=True)
@@ -0,0 +1,81 @@
+# config_cache.py
+# ------------------------------------------------------------------
+# Read-through cache for widget config (welcome message, quick links,
+# theme), invalidated through the config_version generation row
+# ------------------------------------------------------------------
+
+import os
+import time
+import threading
+from typing import Any, Callable, Dict
+
+from sqlite_utils import get_config_generation
+
+# ───────────────  cache settings  ───────────────
+# How often the generation row is re-read; bounds how long another worker's
+# config write can stay invisible here (writes in this worker show at once)
+CONFIG_CACHE_POLL_S = float(os.getenv("CONFIG_CACHE_POLL_S", "2.0"))
+
+
+class ConfigCache:
+    """
+    Values loaded once per config generation.
+
+    Every config write bumps `config_version.generation` in the same
+    transaction. `get` re-reads that one row at most every `poll_interval`
+    seconds and drops all cached values when it has moved, so widget loads
+    cost no database work in between. Thread-safe: sync endpoints call it
+    from the threadpool.
+    """
+
+    def __init__(self, poll_interval: float = CONFIG_CACHE_POLL_S):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._values: Dict[str, Any] = {}
+        self._generation = None
+        self._checked_at = float("-inf")
+        self._epoch = 0                  # bumped on every clear, so a slow load cannot cache a stale value
+        self.hits = 0
+        self.misses = 0
+
+    def _sync(self) -> None:
+        if time.monotonic() - self._checked_at < self.poll_interval:
+            return
+        generation = get_config_generation()
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if generation != self._generation:
+                self._generation = generation
+                self._clear()
+
+    def _clear(self) -> None:
+        self._values.clear()
+        self._epoch += 1
+
+    def get(self, name: str, loader: Callable[[], Any]) -> Any:
+        """Cached value for `name`, calling `loader()` on a miss."""
+        self._sync()
+        with self._lock:
+            if name in self._values:
+                self.hits += 1
+                return self._values[name]
+            self.misses += 1
+            epoch = self._epoch
+        value = loader()
+        with self._lock:
+            if self._epoch == epoch:
+                self._values[name] = value
+        return value
+
+    def invalidate(self) -> None:
+        """Drop cached values now and re-read the generation on the next `get`."""
+        with self._lock:
+            self._clear()
+            self._checked_at = float("-inf")
+
+    def stats(self) -> Dict:
+        return {"generation": self._generation, "cached": sorted(self._values),
+                "hits": self.hits, "misses": self.misses}
+
+
+config_cache = ConfigCache()
@@ -0,0 +1,159 @@
+# dataset_jobs.py
+# ------------------------------------------------------------------
+# In-process background runner for dataset ingestion jobs
+# (state persisted in the dataset_jobs table of leads.db)
+# ------------------------------------------------------------------
+
+import os
+import time
+import asyncio
+import traceback
+from typing import Awaitable, Callable, Dict, List
+
+import aiofiles
+
+from db_pool import run_db
+from dataset_upload import UploadProgress, stream_dataset_upload, delete_uploaded_files
+from file_embaded import index_dataset_bytes, prebuild_dataset_index, get_active_index
+from sqlite_utils import store_versioned_dataset, update_dataset_job, get_unfinished_dataset_jobs
+
+# ───────────────  job settings  ───────────────
+DATASET_JOB_CONCURRENCY = int(os.getenv("DATASET_JOB_CONCURRENCY", "1"))
+PROGRESS_WRITE_INTERVAL_S = 1.0          # throttle progress rows written while uploading
+
+
+class DatasetJobRunner:
+    """
+    Runs submitted jobs as asyncio tasks, at most `concurrency` at a time,
+    and records queued → running → completed/failed in the job table.
+    """
+
+    def __init__(self, concurrency: int = DATASET_JOB_CONCURRENCY):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def submit(self, job_id: str, job: Callable[[], Awaitable[Dict]]) -> None:
+        self._tasks[job_id] = asyncio.create_task(self._run(job_id, job))
+
+    async def _run(self, job_id: str, job: Callable[[], Awaitable[Dict]]) -> None:
+        try:
+            async with self._semaphore:
+                await run_db(update_dataset_job, job_id, status="running")
+                result = await job()
+            await run_db(update_dataset_job, job_id, status="completed", stage="done", result=result)
+            print(f"Dataset job {job_id} completed.")
+        except asyncio.CancelledError:
+            await run_db(update_dataset_job, job_id, status="failed", error="Cancelled: the server shut down")
+            raise
+        except Exception as e:
+            traceback.print_exc()
+            await run_db(update_dataset_job, job_id, status="failed", error=str(e))
+        finally:
+            self._tasks.pop(job_id, None)
+
+    @property
+    def active_jobs(self) -> List[str]:
+        return list(self._tasks)
+
+    async def shutdown(self) -> None:
+        """Cancel running jobs; each one marks itself failed before exiting."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+async def ingest_dataset(job_id: str, client, source_path: str, version_label: str,
+                         description: str, created_by: str, chunk_size: int) -> Dict:
+    """
+    Upload a spooled JSON dataset in chunks, pre-build its FAQ index, then activate it.
+
+    The version is stored (and so activated) only once its index is ready, so
+    chat never waits on a version that was just uploaded.
+    """
+    progress = UploadProgress(version_label)
+    last_write = 0.0
+
+    async def index_chunk(file_id: str, file_data: bytes) -> None:
+        nonlocal last_write
+        # Embed now and persist to disk so chat never pays for it after a restart
+        try:
+            await index_dataset_bytes(file_id, file_data, register=False)
+        except Exception as e:
+            print(f"WARNING: Could not pre-build embeddings for {file_id}; will build on first chat: {e}")
+        if time.monotonic() - last_write >= PROGRESS_WRITE_INTERVAL_S:
+            last_write = time.monotonic()
+            await run_db(update_dataset_job, job_id, progress=progress.as_dict())
+
+    try:
+        await run_db(update_dataset_job, job_id, stage="uploading")
+        async with aiofiles.open(source_path, "rb") as f:
+            file_ids = await stream_dataset_upload(
+                client, f.read, version_label, chunk_size,
+                progress=progress, after_upload=index_chunk,
+            )
+    finally:
+        await run_db(update_dataset_job, job_id, progress=progress.as_dict())
+        await asyncio.to_thread(_remove_file, source_path)
+
+    try:
+        await run_db(update_dataset_job, job_id, stage="indexing")
+        index_key = await prebuild_dataset_index(file_ids)
+
+        await run_db(
+            store_versioned_dataset,
+            version_label=version_label,
+            description=description,
+            file_ids=file_ids,
+            total_records=progress.records_parsed,
+            created_by=created_by,
+        )
+    except BaseException:
+        # No version references the chunks yet, so nothing else will ever clean them up
+        await delete_uploaded_files(client, file_ids)
+        raise
+    await get_active_index(wait=True)        # swaps to the pre-built index once it is warm
+
+    return {
+        "version": version_label,
+        "total_records": progress.records_parsed,
+        "uploaded_files": file_ids,
+        "chunks_created": len(file_ids),
+        "index": index_key,
+    }
+
+
+def _process_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return False                 # this process just started, so it owns no jobs yet
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def recover_orphaned_jobs() -> int:
+    """
+    Mark jobs whose worker process is gone as failed and remove their spooled uploads.
+
+    Runs at startup; jobs owned by other live workers are left alone.
+    """
+    orphaned = 0
+    for job in get_unfinished_dataset_jobs():
+        if job["worker_pid"] and _process_alive(job["worker_pid"]):
+            continue
+        update_dataset_job(job["id"], status="failed", error="Interrupted: the worker running this job stopped")
+        if job["source_path"]:
+            _remove_file(job["source_path"])
+        orphaned += 1
+    return orphaned
@@ -0,0 +1,246 @@
+# dataset_upload.py
+# ------------------------------------------------------------------
+# Streaming dataset upload: incremental JSON parse → in-memory JSONL
+# chunks → bounded-parallel uploads to the OpenAI Files API
+# ------------------------------------------------------------------
+
+import os
+import json
+import time
+import random
+import asyncio
+from dataclasses import dataclass, field, asdict
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from openai import APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
+
+# ───────────────  upload settings  ───────────────
+DATASET_UPLOAD_CONCURRENCY = int(os.getenv("DATASET_UPLOAD_CONCURRENCY", "4"))
+DATASET_UPLOAD_MAX_RETRIES = int(os.getenv("DATASET_UPLOAD_MAX_RETRIES", "3"))
+DATASET_UPLOAD_BACKOFF_S = float(os.getenv("DATASET_UPLOAD_BACKOFF_S", "1.0"))
+READ_SIZE = 64 * 1024
+
+# Errors worth another attempt; anything else (bad request, auth) fails the upload at once
+RETRYABLE_ERRORS = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError)
+
+_WHITESPACE = " \t\r\n"
+_DELIMITERS = _WHITESPACE + ",]"
+
+
+class DatasetFormatError(ValueError):
+    """The uploaded body is not a JSON array."""
+
+
+async def iter_json_array(read: Callable[[int], Awaitable[bytes]]) -> AsyncIterator:
+    """
+    Yield the elements of a top-level JSON array as they arrive.
+
+    `read(n)` is an async reader such as UploadFile.read; only the element
+    being decoded and one read buffer are held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    started = False
+    pending = b""
+
+    async def fill() -> bool:
+        nonlocal buf, pos, eof, pending
+        data = await read(READ_SIZE)
+        if not data:
+            eof = True
+            if pending:
+                raise DatasetFormatError("Uploaded file is not valid UTF-8.")
+            return False
+        data = pending + data
+        # Keep a multi-byte character split across reads for the next round
+        try:
+            text = data.decode("utf-8")
+            pending = b""
+        except UnicodeDecodeError as e:
+            if e.start < len(data) - 3:
+                raise DatasetFormatError("Uploaded file is not valid UTF-8.")
+            text, pending = data[:e.start].decode("utf-8"), data[e.start:]
+        buf = buf[pos:] + text
+        pos = 0
+        return True
+
+    async def next_char() -> Optional[str]:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if eof or not await fill():
+                return None
+
+    if await next_char() != "[":
+        raise DatasetFormatError("Expected a JSON array of records.")
+    pos += 1
+
+    while True:
+        ch = await next_char()
+        if ch is None:
+            raise DatasetFormatError("Unexpected end of JSON array.")
+        if ch == "]":
+            pos += 1
+            break
+        if started:
+            if ch != ",":
+                raise DatasetFormatError(f"Expected ',' or ']' at offset {pos}.")
+            pos += 1
+            if await next_char() is None:
+                raise DatasetFormatError("Unexpected end of JSON array.")
+
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof or not await fill():
+                    raise DatasetFormatError("Uploaded file is not a valid JSON.")
+                continue
+            # A number is only complete once a delimiter follows it ("4." decodes as 4)
+            if (isinstance(value, (int, float)) and not eof
+                    and (end == len(buf) or buf[end] not in _DELIMITERS) and await fill()):
+                continue
+            break
+        pos = end
+        started = True
+        yield value
+
+    if await next_char() is not None:
+        raise DatasetFormatError("Unexpected data after the JSON array.")
+
+
+def encode_chunk(records: List[Dict], first_index: int = 0) -> bytes:
+    """
+    The prompt/completion JSONL uploaded for one chunk of dataset records.
+
+    `first_index` is the position of records[0] in the whole dataset, used in errors.
+    """
+    lines = []
+    for i, record in enumerate(records, first_index):
+        prompt, response = record.get("user_input"), record.get("bot_response")
+        if not isinstance(prompt, str) or not isinstance(response, str):
+            raise DatasetFormatError(
+                f"Record {i} needs string 'user_input' and 'bot_response' fields.")
+        lines.append(json.dumps({"prompt": prompt, "completion": " " + response}) + "\n")
+    return "".join(lines).encode("utf-8")
+
+
+@dataclass
+class UploadProgress:
+    """Counters for one dataset upload, safe to serialize for a progress endpoint."""
+    version_label: str
+    status: str = "running"            # running | completed | failed
+    records_parsed: int = 0
+    chunks_built: int = 0
+    chunks_uploaded: int = 0
+    retries: int = 0
+    bytes_uploaded: int = 0
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+
+async def _upload_chunk(client, filename: str, data: bytes, progress: UploadProgress,
+                        after_upload: Optional[Callable[[str, bytes], Awaitable[None]]]) -> str:
+    for attempt in range(DATASET_UPLOAD_MAX_RETRIES + 1):
+        try:
+            response = await client.files.create(file=(filename, data), purpose="fine-tune")
+            break
+        except RETRYABLE_ERRORS as e:
+            if attempt == DATASET_UPLOAD_MAX_RETRIES:
+                raise
+            delay = DATASET_UPLOAD_BACKOFF_S * (2 ** attempt) * (1 + random.random())
+            progress.retries += 1
+            print(f"WARNING: Upload of {filename} failed ({e}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    progress.chunks_uploaded += 1
+    progress.bytes_uploaded += len(data)
+    print(f"[DEBUG] Uploaded {filename} as {response.id} "
+          f"({progress.chunks_uploaded}/{progress.chunks_built} chunks)")
+    if after_upload is not None:
+        await after_upload(response.id, data)
+    return response.id
+
+
+async def delete_uploaded_files(client, file_ids: List[str]) -> None:
+    """Best-effort removal of uploaded chunk files that no dataset version will reference."""
+    for file_id in file_ids:
+        try:
+            await client.files.delete(file_id)
+        except Exception as cleanup_error:
+            print(f"WARNING: Could not delete orphaned upload {file_id}: {cleanup_error}")
+
+
+async def stream_dataset_upload(
+    client,
+    read: Callable[[int], Awaitable[bytes]],
+    version_label: str,
+    chunk_size: int,
+    progress: Optional[UploadProgress] = None,
+    after_upload: Optional[Callable[[str, bytes], Awaitable[None]]] = None,
+) -> List[str]:
+    """
+    Parse, chunk and upload a JSON dataset, returning the file ids in chunk order.
+
+    Chunks start uploading while the rest of the body is still being parsed; at
+    most DATASET_UPLOAD_CONCURRENCY are in flight, which also bounds how many
+    chunk buffers are held in memory. On failure, files already uploaded are
+    deleted (best effort) and the error is re-raised.
+    """
+    progress = progress or UploadProgress(version_label)
+    semaphore = asyncio.Semaphore(DATASET_UPLOAD_CONCURRENCY)
+    tasks: List[asyncio.Task] = []
+
+    async def run(filename: str, data: bytes) -> str:
+        try:
+            return await _upload_chunk(client, filename, data, progress, after_upload)
+        finally:
+            semaphore.release()
+
+    def launch(records: List[Dict]) -> None:
+        progress.chunks_built += 1
+        filename = f"{version_label}_chunk_{progress.chunks_built}.jsonl"
+        data = encode_chunk(records, progress.records_parsed - len(records))
+        tasks.append(asyncio.create_task(run(filename, data)))
+
+    try:
+        records: List[Dict] = []
+        async for record in iter_json_array(read):
+            if not isinstance(record, dict):
+                raise DatasetFormatError("Every dataset record must be a JSON object.")
+            records.append(record)
+            progress.records_parsed += 1
+            if len(records) == chunk_size:
+                await semaphore.acquire()
+                # Surface a failed upload now instead of after parsing the whole body
+                for task in tasks:
+                    if task.done() and task.exception() is not None:
+                        raise task.exception()
+                launch(records)
+                records = []
+        if records:
+            await semaphore.acquire()
+            launch(records)
+        file_ids = list(await asyncio.gather(*tasks))
+    except BaseException as e:
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        await delete_uploaded_files(client, [r for r in results if isinstance(r, str)])
+        progress.status = "failed"
+        progress.error = str(e)
+        progress.finished_at = time.time()
+        raise
+
+    progress.status = "completed"
+    progress.finished_at = time.time()
+    return file_ids
@@ -0,0 +1,125 @@
+# db_pool.py
+# ------------------------------------------------------------------
+# Bounded SQLite connection pool + dedicated executor for blocking DB work
+# ------------------------------------------------------------------
+
+import os
+import queue
+import asyncio
+import sqlite3
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict
+
+# ───────────────  pool settings  ───────────────
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+
+# One executor for every pool so blocking queries never run on the event loop.
+# It is sized like the pool, so its threads never wait on each other for a connection.
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="sqlite")
+
+
+class SQLitePool:
+    """
+    Fixed-size pool of SQLite connections for one database file.
+
+    Connections are opened lazily (up to `size`), put in WAL mode with a
+    busy timeout, and keep sqlite3's prepared-statement cache warm between
+    calls. Callers block when every connection is checked out.
+    """
+
+    def __init__(self, path: str, size: int = DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=size)
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,          # connections move between executor threads
+            cached_statements=DB_STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row      # supports both row[0] and row["col"]
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        """Check a connection out of the pool; uncommitted work is rolled back on return."""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put_nowait(conn)
+            except sqlite3.Error:
+                # Connection is unusable; drop it so a fresh one is opened next time
+                with self._lock:
+                    self._opened -= 1
+                conn.close()
+
+    def close(self) -> None:
+        """Close every idle connection (used on shutdown)."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+_pools: Dict[str, SQLitePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path: str) -> SQLitePool:
+    """Return the shared pool for a database file, creating it on first use."""
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(path, SQLitePool(path))
+    return pool
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking DB function on the dedicated SQLite executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(fn, *args, **kwargs))
+
+
+def close_all_pools() -> None:
+    for pool in list(_pools.values()):
+        pool.close()
@@ -0,0 +1,119 @@
+# embedding_backends.py
+# ------------------------------------------------------------------
+# Embedding providers for FAQ matching (OpenAI API or in-process CPU)
+# ------------------------------------------------------------------
+
+import os
+import re
+import zlib
+import asyncio
+from typing import List, Optional
+
+import numpy as np
+
+# ───────────────  backend settings  ───────────────
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "openai").lower()          # "openai" | "local"
+OPENAI_EMBED_MODEL = "text-embedding-3-small"
+LOCAL_EMBED_DIM = int(os.getenv("LOCAL_EMBED_DIM", "4096"))
+OPENAI_EMBED_BATCH = 100                                              # keep token usage per call low
+
+
+class EmbeddingProvider:
+    """
+    Turns texts into float32 vectors, one row per text.
+
+    `name` identifies the vector space; it keys the on-disk store and the query
+    cache, so vectors from different providers are never compared.
+    """
+
+    name: str = ""
+    default_threshold: float = 0.80
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Remote embeddings via the OpenAI API (the original behaviour)."""
+
+    default_threshold = 0.80
+
+    def __init__(self, client, model: str = OPENAI_EMBED_MODEL):
+        self.client = client
+        self.model = model
+        self.name = model
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        if self.client is None:
+            raise RuntimeError("OPENAI_API_KEY is not set; use EMBED_BACKEND=local for offline embeddings")
+        all_vectors: List[List[float]] = []
+        for i in range(0, len(texts), OPENAI_EMBED_BATCH):
+            batch = texts[i:i + OPENAI_EMBED_BATCH]
+            resp = await self.client.embeddings.create(model=self.model, input=batch)
+            all_vectors.extend([d.embedding for d in resp.data])
+        return np.array(all_vectors, dtype=np.float32)
+
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    In-process CPU embeddings: hashed word unigrams plus character 3-5 grams.
+
+    Each feature is hashed (crc32, so every worker agrees) into `dim` buckets
+    with a hash-derived sign, counts are log-scaled and the row is L2-normalized.
+    It is a lexical vector, so it matches rephrasings less well than a learned
+    model, but it needs no network and embeds a short message in well under 1 ms.
+    """
+
+    default_threshold = 0.70
+
+    def __init__(self, dim: int = LOCAL_EMBED_DIM, ngram_range=(3, 5)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.name = f"local-hash-{dim}-c{ngram_range[0]}{ngram_range[1]}"
+
+    def _features(self, text: str) -> List[bytes]:
+        words = _WORD_RE.findall(text.lower())
+        features = [b"w:" + w.encode("utf-8") for w in words]
+        lo, hi = self.ngram_range
+        for w in words:
+            padded = f" {w} ".encode("utf-8")
+            for n in range(lo, hi + 1):
+                features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def embed_one(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        features = self._features(text)
+        if not features:
+            return vec
+        hashes = np.fromiter((zlib.crc32(f) for f in features), dtype=np.uint32, count=len(features))
+        buckets = (hashes % self.dim).astype(np.int64)
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+        np.add.at(vec, buckets, signs)
+        vec = np.sign(vec) * np.log1p(np.abs(vec))
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def embed_sync(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self.embed_one(t) for t in texts])
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        # A single message is cheaper to embed inline than to hand to a thread
+        if len(texts) <= 8:
+            return self.embed_sync(texts)
+        return await asyncio.to_thread(self.embed_sync, texts)
+
+
+def get_embedding_provider(client=None, backend: Optional[str] = None) -> EmbeddingProvider:
+    """Build the provider selected by EMBED_BACKEND (or `backend`)."""
+    backend = (backend or EMBED_BACKEND).lower()
+    if backend == "local":
+        return HashingEmbeddingProvider()
+    if backend == "openai":
+        return OpenAIEmbeddingProvider(client)
+    raise ValueError(f"Unknown EMBED_BACKEND {backend!r}; expected 'openai' or 'local'")
@@ -86,23 +86,448 @@
 
 # file_embaded.py
 import os
-from typing import Optional, List, Dict, Tuple
+import re
+import time
+import hashlib
+import threading
+from dataclasses import dataclass
+from collections import OrderedDict
+from typing import Optional, List, Dict, Tuple, Callable, Awaitable
 from openai import AsyncOpenAI
 import json, sqlite3, aiofiles, asyncio
 from functools import lru_cache
 import numpy as np
 from dotenv import load_dotenv
+from db_pool import get_pool, run_db
+from embedding_backends import get_embedding_provider
+from lexical_index import LexicalIndex
+from ann_index import IVFIndex, ANN_MIN_ROWS
 
 load_dotenv()
 
 EMBED_MODEL = "text-embedding-3-small" 
 DATABASE_FILE = "leads.db"
-SIM_THRESHOLD = 0.80  # Lowered for better matching
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Files API client; None without a key, so EMBED_BACKEND=local runs fully offline
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")) if os.getenv("OPENAI_API_KEY") else None
 
-_cached_file_id: Optional[str] = None
-_cached_vectors: Optional[np.ndarray] = None
-_cached_answers: Optional[List[str]] = None
+# Vector backend (EMBED_BACKEND=openai|local); its name keys the disk store and query cache
+embedding_provider = get_embedding_provider(client)
+SIM_THRESHOLD = float(os.getenv("SIM_THRESHOLD", embedding_provider.default_threshold))
+
+# Upper bound on the FAQ matrices kept in memory across dataset versions
+EMBED_INDEX_MEMORY_BUDGET_MB = int(os.getenv("EMBED_INDEX_MEMORY_BUDGET_MB", "512"))
+
+# Local on-disk store of computed embeddings: <dir>/<model>/<content sha256>/{vectors.npy,records.json}
+EMBED_STORE_DIR = os.getenv("EMBED_STORE_DIR", "embeddings")
+
+# Cache of user-message embeddings keyed by normalized text; optionally mirrored to SQLite
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "10000"))
+QUERY_EMBED_CACHE_PERSIST = os.getenv("QUERY_EMBED_CACHE_PERSIST", "false").lower() in ("1", "true", "yes")
+
+# Lexical prefilter: an exact prompt hit or a decisive BM25 hit answers without embedding the message
+HYBRID_LEXICAL_ENABLED = os.getenv("HYBRID_LEXICAL_ENABLED", "true").lower() in ("1", "true", "yes")
+LEXICAL_DECISIVE_SCORE = float(os.getenv("LEXICAL_DECISIVE_SCORE", "0.90"))   # min coverage of prompt and query
+LEXICAL_DECISIVE_MARGIN = float(os.getenv("LEXICAL_DECISIVE_MARGIN", "0.15")) # lead over the runner-up
+
+# Compact copy of the FAQ matrix scanned at query time: "none" | "float16" | "int8" (per-row scale).
+# The float32 matrix stays memory-mapped and only rescores the top candidates. Applied to
+# IVF-backed indexes only: NumPy widens codes to float32 to multiply, so full scans get slower.
+EMBED_INDEX_QUANTIZATION = os.getenv("EMBED_INDEX_QUANTIZATION", "none").lower()
+QUANTIZED_RESCORE_FACTOR = 4         # candidates rescored in float32 = max(k * factor, minimum)
+QUANTIZED_RESCORE_MIN = 32
+QUANTIZED_SCAN_BLOCK = 16384         # rows widened to float32 at a time during a full scan
+
+# Chunk files of a dataset version fetched/embedded in parallel when building its merged index
+DATASET_DOWNLOAD_CONCURRENCY = int(os.getenv("DATASET_DOWNLOAD_CONCURRENCY", "8"))
+
+
+class EmbeddingIndex:
+    """
+    FAQ prompts/answers for one dataset file with a unit-normalized float32 matrix,
+    optionally a quantized copy of it (`codes`, plus per-row `scales` for int8).
+
+    The BM25 index over the prompts is built on first use (`lexical`), so
+    snapshot loads, IVF reorder copies and merge intermediates never pay for it.
+    """
+
+    def __init__(self, key: str, vectors: np.ndarray, answers: List[str], prompts: List[str],
+                 normalized: bool = False, ivf: Optional[IVFIndex] = None,
+                 codes: Optional[np.ndarray] = None, scales: Optional[np.ndarray] = None):
+        self.key = key
+        # Already-normalized matrices (e.g. memory-mapped from disk) are used as-is, without a copy
+        self.vectors = vectors if normalized else _normalize_rows(vectors)
+        self.answers = answers
+        self.prompts = prompts
+        self._lexical: Optional[LexicalIndex] = None
+        self._lexical_lock = threading.Lock()
+        self._lexical_pending = False
+        # Approximate search over list-ordered rows; None means exact scan
+        self.ivf = ivf
+        self.codes = codes
+        self.scales = scales
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes scanned per query; with codes the float32 matrix is only touched for rescoring."""
+        scanned = self.vectors.nbytes if self.codes is None else self.codes.nbytes
+        if self.scales is not None:
+            scanned += self.scales.nbytes
+        return scanned + (self.ivf.nbytes if self.ivf is not None else 0)
+
+    def __len__(self) -> int:
+        return len(self.answers)
+
+    @property
+    def lexical(self) -> LexicalIndex:
+        """The BM25 index, built on first access (pure Python: call it off the event loop)."""
+        if self._lexical is None:
+            with self._lexical_lock:
+                if self._lexical is None:
+                    self._lexical = LexicalIndex(self.prompts)
+        return self._lexical
+
+    @property
+    def lexical_ready(self) -> bool:
+        return self._lexical is not None
+
+    def warm_lexical_in_background(self) -> None:
+        """Start building `lexical` on a worker thread (once); lookups skip it until it is ready."""
+        if self._lexical is None and not self._lexical_pending:
+            self._lexical_pending = True
+            asyncio.get_running_loop().run_in_executor(None, lambda: self.lexical)
+
+    def build_ivf(self) -> "EmbeddingIndex":
+        """Copy of this index reordered into IVF list order, with the IVF attached."""
+        ivf, order = IVFIndex.build(self.vectors)
+        return EmbeddingIndex(
+            self.key, np.ascontiguousarray(self.vectors[order]),
+            [self.answers[i] for i in order], [self.prompts[i] for i in order],
+            normalized=True, ivf=ivf,
+        )
+
+    def search(self, q_vec: np.ndarray, k: int = 1, exact: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k cosine search: one matmul against the pre-normalized rows, or the
+        IVF lists nearest the query when an IVF is attached (unless `exact`).
+        Returns (row indices, scores), best first.
+        """
+        q_vec = np.asarray(q_vec, dtype=np.float32)
+        q_norm = np.linalg.norm(q_vec)
+        if q_norm == 0 or len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        q_unit = q_vec / q_norm
+
+        if self.codes is None:
+            if self.ivf is not None and not exact:
+                return self.ivf.search(self._score_slice(q_unit), q_unit, k)
+            return _top_k(np.arange(len(self)), self.vectors @ q_unit, k)
+
+        # Quantized: shortlist on the compact codes, then rescore it with the float32 rows
+        shortlist = max(k * QUANTIZED_RESCORE_FACTOR, QUANTIZED_RESCORE_MIN)
+        score_slice = self._score_slice(q_unit)
+        if self.ivf is not None and not exact:
+            rows, _ = self.ivf.search(score_slice, q_unit, shortlist)
+        else:
+            n = len(self)
+            sims = np.concatenate([score_slice(start, min(start + QUANTIZED_SCAN_BLOCK, n))
+                                   for start in range(0, n, QUANTIZED_SCAN_BLOCK)])
+            rows, _ = _top_k(np.arange(n), sims, shortlist)
+        rows = np.sort(rows)                          # ascending reads from the memory-mapped file
+        return _top_k(rows, self.vectors[rows] @ q_unit, k)
+
+    def _score_slice(self, q_unit: np.ndarray):
+        """Similarity of the query to rows start:end, from the codes when present."""
+        if self.codes is None:
+            return lambda start, end: self.vectors[start:end] @ q_unit
+
+        def score(start: int, end: int) -> np.ndarray:
+            sims = self.codes[start:end].astype(np.float32) @ q_unit
+            if self.scales is not None:
+                sims *= self.scales[start:end]
+            return sims
+        return score
+
+    def quantize(self, mode: str) -> "EmbeddingIndex":
+        """Attach a float16 or int8 copy of the matrix (in place); returns self."""
+        self.codes, self.scales = quantize_rows(self.vectors, mode)
+        return self
+
+
+def _top_k(rows: np.ndarray, sims: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """The k highest-scoring (rows, sims) pairs, best first."""
+    k = min(k, sims.shape[0])
+    if k < sims.shape[0]:
+        top = np.argpartition(sims, -k)[-k:]
+    else:
+        top = np.arange(sims.shape[0])
+    top = top[np.argsort(sims[top])[::-1]]
+    return rows[top], sims[top]
+
+
+def quantize_rows(vectors: np.ndarray, mode: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Compact copy of unit-normalized rows: (codes, scales).
+
+    float16 halves the matrix; int8 quarters it, storing each row as
+    round(x / scale) with scale = max|x| / 127 for that row.
+    """
+    if mode == "float16":
+        return vectors.astype(np.float16), None
+    if mode != "int8":
+        raise ValueError(f"Unknown quantization {mode!r}; expected 'float16' or 'int8'")
+    n = vectors.shape[0]
+    codes = np.empty(vectors.shape, dtype=np.int8)
+    scales = np.empty(n, dtype=np.float32)
+    for start in range(0, n, QUANTIZED_SCAN_BLOCK):
+        block = np.asarray(vectors[start:start + QUANTIZED_SCAN_BLOCK], dtype=np.float32)
+        block_scales = np.abs(block).max(axis=1) / 127
+        block_scales[block_scales == 0] = 1.0
+        codes[start:start + block.shape[0]] = np.round(block / block_scales[:, None])
+        scales[start:start + block.shape[0]] = block_scales
+    return codes, scales
+
+
+@dataclass
+class FaqMatch:
+    """One FAQ search hit."""
+    index: int
+    score: float
+    prompt: str
+    answer: str
+    source: str = "vector"      # "exact" | "bm25" | "vector"
+
+
+@dataclass
+class RetrievalResult:
+    """
+    FAQ lookup for one user message, computed once per /chat turn and shared
+    by every stage of the state machine.
+    """
+    query: str
+    matches: List[FaqMatch]
+    threshold: float
+
+    @property
+    def best(self) -> Optional[FaqMatch]:
+        return self.matches[0] if self.matches else None
+
+    @property
+    def answer(self) -> Optional[str]:
+        """Best answer if it clears the similarity threshold, else None."""
+        best = self.best
+        if best is not None and best.score >= self.threshold:
+            return best.answer.lstrip()
+        return None
+
+
+class IndexRegistry:
+    """
+    Holds several EmbeddingIndex objects keyed by dataset file/version and
+    evicts the least recently used ones once their matrices exceed the budget.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._indexes: "OrderedDict[str, EmbeddingIndex]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[EmbeddingIndex]:
+        index = self._indexes.get(key)
+        if index is not None:
+            self._indexes.move_to_end(key)
+        return index
+
+    def put(self, index: EmbeddingIndex) -> None:
+        self._indexes[index.key] = index
+        self._indexes.move_to_end(index.key)
+        # Never evict the index that was just added, even if it alone exceeds the budget
+        while len(self._indexes) > 1 and self.total_bytes > self.max_bytes:
+            evicted_key, _ = self._indexes.popitem(last=False)
+            print(f"[DEBUG] Evicted embedding index {evicted_key} (memory budget)")
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._indexes
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(index.nbytes for index in self._indexes.values())
+
+    def stats(self) -> Dict:
+        return {
+            "indexes": list(self._indexes.keys()),
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one in-flight coroutine.
+
+    The first caller starts the work; callers arriving while it runs await the
+    same result (or exception). Once it finishes the key is free again.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self.started = 0
+        self.joined = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+            self.started += 1
+        else:
+            self.joined += 1
+        # shield: one cancelled caller must not cancel the work the others are waiting on
+        return await asyncio.shield(future)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._calls
+
+    def stats(self) -> Dict:
+        return {"in_flight": list(self._calls), "started": self.started, "joined": self.joined}
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+_registry = IndexRegistry(EMBED_INDEX_MEMORY_BUDGET_MB * 1024 * 1024)
+# One load/download/embed per dataset file or merged version, however many requests ask for it
+_index_builds = SingleFlight()
+
+
+def normalize_query_text(text: str) -> str:
+    """Cache key for a user message: case, repeated whitespace and surrounding punctuation are ignored."""
+    return re.sub(r"\s+", " ", text.lower()).strip(" .!?,;:'\"")
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU of query embeddings with hit/miss counters.
+
+    With `persist=True` entries are also written to a SQLite table, so they
+    survive restarts and are shared by every worker using the same leads.db.
+    Those writes run in the background; a miss never waits on them.
+    """
+
+    def __init__(self, max_entries: int, persist: bool = False):
+        self.max_entries = max_entries
+        self.persist = persist
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self._table_ready = False
+        self._writes: set = set()            # in-flight _db_put tasks, referenced until done
+
+    def _ensure_table(self, conn: sqlite3.Connection) -> None:
+        if not self._table_ready:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    embed_model TEXT NOT NULL,
+                    query_key TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (embed_model, query_key)
+                ) WITHOUT ROWID
+            """)
+            conn.commit()
+            self._table_ready = True
+
+    def _db_get(self, key: str) -> Optional[np.ndarray]:
+        with get_pool(DATABASE_FILE).connection() as conn:
+            self._ensure_table(conn)
+            row = conn.execute(
+                "SELECT vector FROM query_embeddings WHERE embed_model = ? AND query_key = ?",
+                (embedding_provider.name, key)
+            ).fetchone()
+        return np.frombuffer(row[0], dtype=np.float32) if row else None
+
+    def _db_put(self, key: str, vector: np.ndarray) -> None:
+        with get_pool(DATABASE_FILE).connection() as conn:
+            self._ensure_table(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (embed_model, query_key, vector) VALUES (?, ?, ?)",
+                (embedding_provider.name, key, vector.astype(np.float32).tobytes())
+            )
+            conn.commit()
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[np.ndarray]:
+        vector = self._entries.get(key)
+        if vector is not None:
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            return vector
+        if self.persist:
+            vector = await run_db(self._db_get, key)
+            if vector is not None:
+                self._remember(key, vector)
+                self.db_hits += 1
+                return vector
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, vector: np.ndarray) -> None:
+        self._remember(key, vector)
+        if self.persist:
+            task = asyncio.create_task(run_db(self._db_put, key, vector))
+            self._writes.add(task)
+            task.add_done_callback(self._write_done)
+
+    def _write_done(self, task: asyncio.Task) -> None:
+        self._writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"WARNING: Persisting a query embedding failed: {task.exception()}")
+
+    def stats(self) -> Dict:
+        lookups = self.memory_hits + self.db_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "persist": self.persist,
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.db_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+_query_cache = QueryEmbeddingCache(QUERY_EMBED_CACHE_SIZE, persist=QUERY_EMBED_CACHE_PERSIST)
+
+
+async def embed_query(text: str) -> np.ndarray:
+    """Embedding for a user message, served from the query cache when the normalized text was seen before."""
+    key = normalize_query_text(text)
+    vector = await _query_cache.get(key)
+    if vector is None:
+        vector = (await embedding_provider.embed([text]))[0]
+        await _query_cache.put(key, vector)
+    return vector
+
+
+_retrieval_counts = {"exact": 0, "bm25": 0, "vector": 0}
+
+
+def get_faq_metrics() -> Dict:
+    return {
+        "retrieval_sources": dict(_retrieval_counts),
+        "query_embedding_cache": _query_cache.stats(),
+        "indexes": _registry.stats(),
+        "index_builds": _index_builds.stats(),
+        "active_index": _active_index.key if _active_index is not None else None,
+    }
 
 import inspect, json
 
@@ -111,6 +536,17 @@ async def download_uploaded_dataset(file_id: str) -> list[dict]:
     Fetch the JSONL file stored on OpenAI and return it as a list of dicts.
     Works with every AsyncOpenAI version.
     """
+    return _parse_jsonl(await _download_file_bytes(file_id))
+
+
+def _parse_jsonl(raw: bytes) -> list[dict]:
+    lines = raw.decode("utf-8").splitlines()
+    return [json.loads(line) for line in lines if line.strip()]
+
+
+async def _download_file_bytes(file_id: str) -> bytes:
+    if client is None:
+        raise RuntimeError("OPENAI_API_KEY is not set; cannot download dataset files")
     resp = await client.files.content(file_id)          # bytes OR response
 
     if isinstance(resp, (bytes, bytearray)):            # ≥ v1.3  → bytes
@@ -123,65 +559,453 @@ async def download_uploaded_dataset(file_id: str) -> list[dict]:
     else:                                               # unexpected; fallback
         raise TypeError(f"Unsupported response type from files.content(): {type(resp)}")
 
-    lines = raw.decode("utf-8").splitlines()
-    return [json.loads(line) for line in lines]
+    return raw
 
 def _get_latest_file_id() -> Optional[str]:
     """Return newest file_id from uploaded_files table (or None)."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT file_id FROM uploaded_files ORDER BY id DESC LIMIT 1")
-    row = cursor.fetchone()
-    conn.close()
-    return row[0]
+    with get_pool(DATABASE_FILE).connection() as conn:
+        try:
+            row = conn.execute("SELECT file_id FROM uploaded_files ORDER BY id DESC LIMIT 1").fetchone()
+        except sqlite3.OperationalError:      # nothing uploaded yet → table missing
+            return None
+    return row[0] if row else None
 
 
-async def build_embedding_cache(file_id: str) -> Tuple[np.ndarray, List[str]]:
-    global _cached_file_id, _cached_vectors, _cached_answers
-    
-    # Return cached if already built for this file_id
-    if file_id == _cached_file_id and _cached_vectors is not None:
-        return _cached_vectors, _cached_answers
-    
-    # Download and process dataset
-    dataset = await download_uploaded_dataset(file_id)
-    
+# ───────────────  on-disk embedding store  ───────────────
+
+def _store_root() -> str:
+    return os.path.join(EMBED_STORE_DIR, re.sub(r"[^A-Za-z0-9_.-]", "_", embedding_provider.name))
+
+
+def _snapshot_dir(content_hash: str) -> str:
+    return os.path.join(_store_root(), content_hash)
+
+
+def _file_pointer_path(file_id: str) -> str:
+    return os.path.join(_store_root(), "by_file", re.sub(r"[^A-Za-z0-9_.-]", "_", file_id))
+
+
+def _atomic_write(path: str, write) -> None:
+    # Write to a temp name and rename, so other workers never map a half-written file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def _save_snapshot(content_hash: str, index: EmbeddingIndex) -> None:
+    folder = _snapshot_dir(content_hash)
+    records = json.dumps({"prompts": index.prompts, "answers": index.answers}).encode("utf-8")
+    _atomic_write(os.path.join(folder, "records.json"), lambda f: f.write(records))
+    _atomic_write(os.path.join(folder, "vectors.npy"), lambda f: np.save(f, index.vectors))
+    if index.ivf is not None:
+        _atomic_write(os.path.join(folder, "ivf_centroids.npy"), lambda f: np.save(f, index.ivf.centroids))
+        _atomic_write(os.path.join(folder, "ivf_offsets.npy"), lambda f: np.save(f, index.ivf.offsets))
+    _save_codes(folder, index)
+
+
+def _codes_paths(folder: str, mode: str) -> Tuple[str, str]:
+    return os.path.join(folder, f"codes_{mode}.npy"), os.path.join(folder, f"scales_{mode}.npy")
+
+
+def _save_codes(folder: str, index: EmbeddingIndex) -> None:
+    if index.codes is None:
+        return
+    codes_path, scales_path = _codes_paths(folder, EMBED_INDEX_QUANTIZATION)
+    if index.scales is not None:
+        _atomic_write(scales_path, lambda f: np.save(f, index.scales))
+    _atomic_write(codes_path, lambda f: np.save(f, index.codes))
+
+
+def _load_codes(folder: str, index: EmbeddingIndex) -> None:
+    """Map the snapshot's quantized codes for the configured mode, writing them first if missing."""
+    if EMBED_INDEX_QUANTIZATION == "none" or index.ivf is None:
+        return
+    codes_path, scales_path = _codes_paths(folder, EMBED_INDEX_QUANTIZATION)
+    try:
+        # codes are written last, so their presence means the scales are complete too
+        codes = np.load(codes_path, mmap_mode="r")
+        scales = np.load(scales_path) if EMBED_INDEX_QUANTIZATION == "int8" else None
+    except (OSError, ValueError):
+        _save_codes(folder, index.quantize(EMBED_INDEX_QUANTIZATION))
+        codes = np.load(codes_path, mmap_mode="r")
+        scales = index.scales
+    index.codes, index.scales = codes, scales
+
+
+def _load_snapshot(key: str, content_hash: str) -> Optional[EmbeddingIndex]:
+    """Map a stored snapshot read-only; the OS page cache is shared by every worker."""
+    folder = _snapshot_dir(content_hash)
+    try:
+        with open(os.path.join(folder, "records.json"), encoding="utf-8") as f:
+            records = json.load(f)
+        vectors = np.load(os.path.join(folder, "vectors.npy"), mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    try:
+        ivf = IVFIndex(np.load(os.path.join(folder, "ivf_centroids.npy")),
+                       np.load(os.path.join(folder, "ivf_offsets.npy")))
+    except (OSError, ValueError):
+        ivf = None                    # small dataset, or snapshot written before IVF existed
+    index = EmbeddingIndex(key, vectors, records["answers"], records["prompts"], normalized=True, ivf=ivf)
+    _load_codes(folder, index)
+    return index
+
+
+def _remember_file_hash(file_id: str, content_hash: str) -> None:
+    _atomic_write(_file_pointer_path(file_id), lambda f: f.write(content_hash.encode("ascii")))
+
+
+def _load_snapshot_for_file(file_id: str) -> Optional[EmbeddingIndex]:
+    try:
+        with open(_file_pointer_path(file_id), encoding="ascii") as f:
+            content_hash = f.read().strip()
+    except OSError:
+        return None
+    return _load_snapshot(file_id, content_hash)
+
+
+async def _embed_dataset(file_id: str, dataset: List[Dict]) -> EmbeddingIndex:
     prompts = [row["prompt"] if "prompt" in row else row["user_input"]
                for row in dataset]
     answers = [row["completion"] if "completion" in row else row["bot_response"]
                for row in dataset]
-    
-    # batch embed to keep token-usage low (100 at a time)
-    all_vectors: List[List[float]] = []
-    for i in range(0, len(prompts), 100):
-        batch = prompts[i:i+100]
-        resp = await client.embeddings.create(model=EMBED_MODEL, input=batch)
-        all_vectors.extend([d.embedding for d in resp.data])
-    
-    # Cache the results
-    _cached_file_id = file_id
-    _cached_vectors = np.array(all_vectors, dtype=np.float32)
-    _cached_answers = answers
-    
-    return _cached_vectors, _cached_answers
 
-async def answer_from_uploaded_file(user_msg: str) -> Optional[str]:
-    file_id = _get_latest_file_id()
-    if not file_id:
+    vectors = await embedding_provider.embed(prompts)
+    return EmbeddingIndex(file_id, vectors, answers, prompts)
+
+
+def _prepare_for_serving(index: EmbeddingIndex) -> EmbeddingIndex:
+    """Attach the IVF and quantized codes the configuration asks for (CPU-bound; run in a thread)."""
+    if len(index) >= ANN_MIN_ROWS:
+        index = index.build_ivf()
+    if EMBED_INDEX_QUANTIZATION != "none" and index.ivf is not None:
+        index.quantize(EMBED_INDEX_QUANTIZATION)
+    return index
+
+
+async def index_dataset_bytes(file_id: str, raw: bytes, register: bool = True) -> EmbeddingIndex:
+    """
+    Build (or reuse) the index for a JSONL dataset file's exact bytes and persist it.
+
+    Called at upload time with the chunk that was sent to OpenAI, so the first
+    /chat after an upload or restart only has to map the stored snapshot.
+    Chunks of a multi-file version pass register=False: only their merged
+    index is served, so keeping each chunk in memory would be wasted.
+    """
+    content_hash = hashlib.sha256(raw).hexdigest()
+    index = await asyncio.to_thread(_load_snapshot, file_id, content_hash)
+    if index is None:
+        index = await _embed_dataset(file_id, _parse_jsonl(raw))
+        index = await asyncio.to_thread(_prepare_for_serving, index)
+        await asyncio.to_thread(_save_snapshot, content_hash, index)
+        # Re-map the saved file so this process shares the page-cached copy too
+        index = await asyncio.to_thread(_load_snapshot, file_id, content_hash) or index
+    await asyncio.to_thread(_remember_file_hash, file_id, content_hash)
+    if register:
+        _registry.put(index)
+    return index
+
+
+async def get_embedding_index(file_id: str) -> EmbeddingIndex:
+    """Return the in-memory index for a dataset file: registry, then disk, then download + embed."""
+    index = _registry.get(file_id)
+    if index is not None:
+        return index
+    index = await _index_builds.do(f"file:{file_id}", lambda: _load_or_build_file_index(file_id))
+    _registry.put(index)
+    return index
+
+
+async def _load_or_build_file_index(file_id: str) -> EmbeddingIndex:
+    index = await asyncio.to_thread(_load_snapshot_for_file, file_id)
+    if index is None:
+        index = await index_dataset_bytes(file_id, await _download_file_bytes(file_id), register=False)
+    return index
+
+
+# ───────────────  active dataset version  ───────────────
+
+def _dataset_key(file_ids: List[str]) -> Optional[str]:
+    """Index key for a set of chunk files: the file id itself for one chunk, else a digest of all of them."""
+    if not file_ids:
         return None
+    if len(file_ids) == 1:
+        return file_ids[0]
+    return "merged-" + hashlib.sha256("\n".join(file_ids).encode("utf-8")).hexdigest()
 
-    vectors, answers = await build_embedding_cache(file_id)
 
-    # embed user message
-    resp = await client.embeddings.create(model=EMBED_MODEL, input=[user_msg])
-    q_vec = np.array(resp.data[0].embedding, dtype=np.float32)
+def _get_active_dataset() -> Tuple[Optional[str], List[str]]:
+    """(index key, chunk file ids) of the active dataset version; falls back to the newest uploaded file."""
+    with get_pool(DATABASE_FILE).connection() as conn:
+        try:
+            row = conn.execute("SELECT file_ids FROM dataset_versions WHERE is_active = 1 LIMIT 1").fetchone()
+        except sqlite3.OperationalError:      # no versioned upload yet → table missing
+            row = None
+    file_ids = json.loads(row[0]) if row else []
+    if not file_ids:
+        file_id = _get_latest_file_id()
+        file_ids = [file_id] if file_id else []
+    return _dataset_key(file_ids), file_ids
 
-    # cosine similarities in one vectorised op
-    sims = vectors @ q_vec / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(q_vec))
-    best_idx = int(np.argmax(sims))
-    
-    print(f"[DEBUG] Best similarity: {sims[best_idx]:.3f}, Answer: {answers[best_idx][:60]}")
-    
-    if sims[best_idx] >= SIM_THRESHOLD:
-        return answers[best_idx].lstrip()
-    return None
+
+def _load_dataset_snapshot(key: str, file_ids: List[str]) -> Optional[EmbeddingIndex]:
+    if len(file_ids) == 1:
+        return _load_snapshot_for_file(key)
+    # File ids are never reused, so the merged key doubles as its snapshot id
+    return _load_snapshot(key, key)
+
+
+def _merge_chunk_indexes(key: str, chunks: List[EmbeddingIndex]) -> EmbeddingIndex:
+    merged = EmbeddingIndex(
+        key, np.concatenate([np.asarray(c.vectors) for c in chunks]),
+        [a for c in chunks for a in c.answers], [p for c in chunks for p in c.prompts],
+        normalized=True,
+    )
+    merged = _prepare_for_serving(merged)
+    _save_snapshot(key, merged)
+    return _load_snapshot(key, key) or merged
+
+
+async def _chunk_index(file_id: str, semaphore: asyncio.Semaphore) -> EmbeddingIndex:
+    index = _registry.get(file_id)
+    if index is not None:
+        return index
+    async with semaphore:
+        return await _index_builds.do(f"file:{file_id}", lambda: _load_or_build_file_index(file_id))
+
+
+async def build_dataset_index(key: str, file_ids: List[str]) -> EmbeddingIndex:
+    """One index over every chunk of a dataset version: registry, then disk, then chunks fetched in parallel."""
+    if len(file_ids) == 1:
+        return await get_embedding_index(key)
+    index = _registry.get(key)
+    if index is not None:
+        return index
+    index = await _index_builds.do(f"dataset:{key}", lambda: _load_or_merge_dataset_index(key, file_ids))
+    _registry.put(index)
+    return index
+
+
+async def _load_or_merge_dataset_index(key: str, file_ids: List[str]) -> EmbeddingIndex:
+    index = await asyncio.to_thread(_load_dataset_snapshot, key, file_ids)
+    if index is None:
+        semaphore = asyncio.Semaphore(DATASET_DOWNLOAD_CONCURRENCY)
+        chunks = await asyncio.gather(*(_chunk_index(file_id, semaphore) for file_id in file_ids))
+        index = await asyncio.to_thread(_merge_chunk_indexes, key, chunks)
+    return index
+
+
+async def prebuild_dataset_index(file_ids: List[str]) -> Optional[str]:
+    """Build and store the index for a version's chunk files before it is activated; returns its key."""
+    key = _dataset_key(file_ids)
+    if key is not None:
+        await build_dataset_index(key, file_ids)
+    return key
+
+
+# The index /chat searches. Replaced by a single assignment once a new version's
+# index is built and warm, so a request never sees a half-built one.
+_active_index: Optional[EmbeddingIndex] = None
+_active_builds: Dict[str, "asyncio.Task[EmbeddingIndex]"] = {}
+_hot_keys: set = set()                      # indexes whose pages have been read in once
+_last_build_error: Optional[str] = None
+_build_failed_at: Dict[str, float] = {}     # key -> monotonic time of its last failed build
+WARM_UP_BLOCK_ROWS = 16384
+# Chat turns don't retry a failed build (e.g. a deleted file) until this has passed
+INDEX_BUILD_RETRY_S = float(os.getenv("INDEX_BUILD_RETRY_S", "60"))
+
+
+def _touch_pages(index: EmbeddingIndex) -> None:
+    """Read the scanned matrix once so the first queries don't fault it in from disk."""
+    matrix = index.codes if index.codes is not None else index.vectors
+    for start in range(0, matrix.shape[0], WARM_UP_BLOCK_ROWS):
+        np.asarray(matrix[start:start + WARM_UP_BLOCK_ROWS]).sum()
+    # Only the index about to serve chat needs its BM25 postings
+    if HYBRID_LEXICAL_ENABLED:
+        index.lexical
+
+
+async def _activate(key: str, file_ids: List[str]) -> EmbeddingIndex:
+    global _active_index, _last_build_error
+    try:
+        index = await build_dataset_index(key, file_ids)
+        await asyncio.to_thread(_touch_pages, index)
+        _hot_keys.add(key)
+        _active_index = index
+        _last_build_error = None
+        _build_failed_at.pop(key, None)
+        print(f"[DEBUG] Active FAQ index is now {key} ({len(index)} rows)")
+        return index
+    except Exception as e:
+        _last_build_error = f"{key}: {e}"
+        _build_failed_at[key] = time.monotonic()
+        raise
+    finally:
+        _active_builds.pop(key, None)
+
+
+def _log_build_failure(task: "asyncio.Task[EmbeddingIndex]") -> None:
+    if not task.cancelled() and task.exception() is not None:
+        print(f"WARNING: Building the FAQ index failed: {task.exception()}")
+
+
+def _retry_wait(key: str) -> float:
+    """Seconds before chat traffic may retry a failed build of `key` (0 if it may now)."""
+    failed_at = _build_failed_at.get(key)
+    if failed_at is None:
+        return 0.0
+    return max(0.0, failed_at + INDEX_BUILD_RETRY_S - time.monotonic())
+
+
+def _start_activation(key: str, file_ids: List[str]) -> "asyncio.Task[EmbeddingIndex]":
+    task = _active_builds.get(key)
+    if task is None:
+        task = asyncio.create_task(_activate(key, file_ids))
+        task.add_done_callback(_log_build_failure)
+        _active_builds[key] = task
+    return task
+
+
+async def get_active_index(wait: bool = False) -> Optional[EmbeddingIndex]:
+    """
+    Index for the active dataset version (None when nothing is uploaded).
+
+    When the active version changes, its index is built in the background and
+    the previous one (or none) keeps answering until it is ready, so chat
+    latency never includes index construction. `wait=True` waits for the build.
+    A failed build is not retried by chat traffic for INDEX_BUILD_RETRY_S
+    (`wait=True` and warm_up_active_index always retry).
+    """
+    global _active_index
+    key, file_ids = await run_db(_get_active_dataset)
+    if key is None:
+        return None
+    current = _active_index
+    if current is not None and current.key == key:
+        return current
+
+    # Already built (e.g. pre-registered by the upload): serve it from this turn on
+    ready = _registry.get(key)
+    if ready is not None:
+        _active_index = ready
+        _hot_keys.add(key)
+        _build_failed_at.pop(key, None)
+        print(f"[DEBUG] Active FAQ index is now {key} ({len(ready)} rows)")
+        return ready
+
+    if not wait and key not in _active_builds and _retry_wait(key) > 0:
+        return current
+    task = _start_activation(key, file_ids)
+    if not wait:
+        return _active_index if task.done() else current
+    # shield: a cancelled request must not cancel a build other requests share
+    return await asyncio.shield(task)
+
+
+async def warm_up_active_index() -> Optional[str]:
+    """Start building/loading the active version's index in the background; returns its key."""
+    key, file_ids = await run_db(_get_active_dataset)
+    if key is not None and key not in _hot_keys:
+        _start_activation(key, file_ids)
+    return key
+
+
+async def get_index_status() -> Dict:
+    """Readiness of the FAQ index: ready once the active version's index is serving and warm."""
+    key, file_ids = await run_db(_get_active_dataset)
+    serving = _active_index
+    return {
+        "ready": key is None or (serving is not None and serving.key == key and key in _hot_keys),
+        "active_key": key,
+        "serving_key": serving.key if serving is not None else None,
+        "rows": len(serving) if serving is not None else 0,
+        "chunks": len(file_ids),
+        "building": key in _active_builds,
+        "last_error": _last_build_error,
+        "retry_in_s": round(_retry_wait(key), 1) if key is not None else 0.0,
+    }
+
+
+def preload_persisted_index() -> Optional[str]:
+    """Map the active dataset's stored snapshot at startup (no network); returns its index key."""
+    global _active_index
+    key, file_ids = _get_active_dataset()
+    if key is None:
+        return None
+    index = _load_dataset_snapshot(key, file_ids)
+    if index is None:
+        return None
+    _registry.put(index)
+    _active_index = index
+    return key
+
+
+async def build_embedding_cache(file_id: str) -> Tuple[np.ndarray, List[str]]:
+    index = await get_embedding_index(file_id)
+    return index.vectors, index.answers
+
+async def search_uploaded_file(user_msg: str, k: int = 5) -> List[FaqMatch]:
+    """
+    Return the k FAQ entries most similar to the message, best first.
+
+    Callers can use the score gap between the first two hits as a confidence margin.
+    """
+    index = await get_active_index()
+    if index is None:
+        return []
+
+    if HYBRID_LEXICAL_ENABLED and not index.lexical_ready:
+        # e.g. the snapshot mapped at startup: vectors answer until BM25 is built
+        index.warm_lexical_in_background()
+    elif HYBRID_LEXICAL_ENABLED:
+        matches = _lexical_matches(index, user_msg, k)
+        if matches:
+            _retrieval_counts[matches[0].source] += 1
+            return matches
+
+    q_vec = await embed_query(user_msg)
+    rows, scores = index.search(q_vec, k)
+    _retrieval_counts["vector"] += 1
+    return [
+        FaqMatch(index=int(i), score=float(s), prompt=index.prompts[i], answer=index.answers[i])
+        for i, s in zip(rows, scores)
+    ]
+
+
+def _lexical_matches(index: EmbeddingIndex, user_msg: str, k: int) -> Optional[List[FaqMatch]]:
+    """
+    Matches from the inverted index when they are decisive, else None (use vectors).
+
+    Decisive means the message is a prompt verbatim (after normalization), or the
+    best BM25 hit covers both the prompt and the message almost entirely and
+    clearly beats the runner-up. Lexical scores are on a 0-1 scale like cosine.
+    """
+    row = index.lexical.lookup_exact(user_msg)
+    if row is not None:
+        return [FaqMatch(index=row, score=1.0, prompt=index.prompts[row], answer=index.answers[row], source="exact")]
+
+    hits = index.lexical.search(user_msg, k)
+    if not hits:
+        return None
+    best_score = hits[0][1]
+    runner_up = hits[1][1] if len(hits) > 1 else 0.0
+    if best_score < LEXICAL_DECISIVE_SCORE or best_score - runner_up < LEXICAL_DECISIVE_MARGIN:
+        return None
+    return [
+        FaqMatch(index=r, score=s, prompt=index.prompts[r], answer=index.answers[r], source="bm25")
+        for r, s in hits
+    ]
+
+
+async def retrieve_faq(user_msg: str, k: int = 5) -> RetrievalResult:
+    """Run the FAQ lookup for a message once; reuse the result instead of searching again."""
+    result = RetrievalResult(query=user_msg, matches=await search_uploaded_file(user_msg, k), threshold=SIM_THRESHOLD)
+    if result.best is not None:
+        print(f"[DEBUG] Best similarity: {result.best.score:.3f} ({result.best.source}), Answer: {result.best.answer[:60]}")
+    return result
+
+
+async def answer_from_uploaded_file(user_msg: str) -> Optional[str]:
+    return (await retrieve_faq(user_msg, k=1)).answer
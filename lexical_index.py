@@ -0,0 +1,111 @@
+# lexical_index.py
+# ------------------------------------------------------------------
+# In-memory BM25 inverted index over FAQ prompts (lexical prefilter)
+# ------------------------------------------------------------------
+
+import re
+import math
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"\w+")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def exact_key(text: str) -> str:
+    """Normalized form used for exact prompt hits (case, spacing and punctuation-insensitive)."""
+    return " ".join(tokenize(text))
+
+
+class LexicalIndex:
+    """
+    BM25 over one dataset's prompts, plus an exact-match table.
+
+    Per-term BM25 weights are precomputed at build time, so scoring a query is
+    a handful of NumPy scatter-adds over the posting lists of its terms.
+    Scores are reported relative to each prompt's own BM25 self-score, which
+    makes them comparable across prompts and datasets (1.0 = every term of
+    the prompt was present in the query). A prompt that appears more than once
+    is matched through its first row only.
+    """
+
+    def __init__(self, prompts: List[str]):
+        self.size = len(prompts)
+        self.exact: Dict[str, int] = {}
+        docs = [tokenize(p) for p in prompts]
+        self._duplicate = np.zeros(self.size, dtype=bool)
+        for row, tokens in enumerate(docs):
+            key = " ".join(tokens)
+            if key in self.exact:
+                self._duplicate[row] = True
+            elif key:                      # a prompt with no words must not match every wordless message
+                self.exact[key] = row
+
+        avgdl = (sum(len(d) for d in docs) / len(docs)) if docs else 0.0
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for row, tokens in enumerate(docs):
+            for term, tf in Counter(tokens).items():
+                postings[term].append((row, tf))
+
+        self.idf: Dict[str, float] = {}
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.self_scores = np.zeros(self.size, dtype=np.float32)
+        doc_len = np.array([len(d) for d in docs], dtype=np.float32)
+        for term, entries in postings.items():
+            rows = np.array([r for r, _ in entries], dtype=np.int64)
+            tfs = np.array([tf for _, tf in entries], dtype=np.float32)
+            idf = math.log(1 + (self.size - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len[rows] / avgdl) if avgdl else BM25_K1
+            weights = (idf * tfs * (BM25_K1 + 1) / (tfs + norm)).astype(np.float32)
+            self.idf[term] = idf
+            self.postings[term] = (rows, weights)
+            np.add.at(self.self_scores, rows, weights)
+        # Weight given to query terms that no prompt contains (rarest possible term)
+        self._unseen_idf = math.log(1 + (self.size + 0.5) / 0.5)
+
+    def lookup_exact(self, query: str) -> Optional[int]:
+        key = exact_key(query)
+        return self.exact.get(key) if key else None
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Top-k distinct prompts for a query as (row, score), best first.
+
+        score = min(prompt coverage, query coverage): the share of the prompt's
+        BM25 self-score matched by the query, capped by the idf-weighted share of
+        the query's own terms that occur in that prompt. Extra words in the
+        query or missing words from the prompt both pull it below 1.0.
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.size:
+            return []
+        scores = np.zeros(self.size, dtype=np.float32)
+        matched_idf = np.zeros(self.size, dtype=np.float32)
+        query_idf = 0.0
+        for term in terms:
+            idf = self.idf.get(term, self._unseen_idf)
+            query_idf += idf
+            posting = self.postings.get(term)
+            if posting is not None:
+                rows, weights = posting
+                scores[rows] += weights
+                matched_idf[rows] += idf
+
+        scores[self._duplicate] = 0.0
+        candidates = np.nonzero(scores)[0]
+        if candidates.size == 0:
+            return []
+        prompt_cov = scores[candidates] / self.self_scores[candidates]
+        query_cov = matched_idf[candidates] / query_idf
+        combined = np.minimum(prompt_cov, query_cov)
+        k = min(k, candidates.size)
+        top = np.argsort(combined)[::-1][:k]
+        return [(int(candidates[i]), float(combined[i])) for i in top]
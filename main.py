@@ -1,7 +1,7 @@
 from typing import List
-from fastapi import FastAPI, HTTPException, status,UploadFile, File,Form,Header,Depends
+from fastapi import FastAPI, HTTPException, status,UploadFile, File,Form,Header,Depends, WebSocket, WebSocketDisconnect, Request, Query, Response
 import aiofiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import ValidationError
 from sqlalchemy.orm import Session
@@ -9,14 +9,16 @@ from datetime import datetime
 import os
 import uuid 
 import re
-import shutil
 import json 
-from typing import List, Optional, Dict,Any
+import asyncio
+import hashlib
+import base64
+import orjson
+from typing import List, Optional, Dict,Any, Awaitable, Callable, Literal
 from helper import get_available_time_slots, parse_slot_selection, parse_budget_amount
-from file_embaded import answer_from_uploaded_file
 import traceback
 from dotenv import load_dotenv
-from file_embaded import answer_from_uploaded_file
+from file_embaded import preload_persisted_index, get_faq_metrics, retrieve_faq, warm_up_active_index, get_index_status
 from datetime import datetime, timedelta
 from jose import jwt
 from passlib.context import CryptContext
@@ -28,9 +30,14 @@ from sqlite_utils import (
     create_admin, update_admin_password
 )
 from auths import (
-    hash_password, verify_password,
-    create_access_token, decode_token
+    hash_password_async, verify_password_async, password_hasher, PasswordHasherBusy,
+    ip_throttle, email_throttle,
+    create_access_token, decode_token, admin_principals
 )
+from db_pool import run_db, close_all_pools
+from dataset_jobs import DatasetJobRunner, ingest_dataset, recover_orphaned_jobs
+from chat_sessions import ChatSession, ChatSessionRegistry
+from config_cache import config_cache
 
 security = HTTPBearer()
 
@@ -51,13 +58,16 @@ SIM_THRESHOLD = 0.85
 
 from schemas import Lead, Message, ChatRequest, ChatResponse, LeadQualificationStage
 from sqlite_utils import (
-    initialize_sqlite_db, get_lead_from_db, save_lead_to_db, get_all_leads_from_db,
+    initialize_sqlite_db, get_lead_from_db, save_lead_to_db,
+    get_leads_page, iter_leads, LEADS_PAGE_MAX,
     detect_recruiting_inquiry, generate_recruiting_response, handle_licensing_status_response,
-    get_recruiting_leads_from_db,ensure_admin_table,store_uploaded_file_info,store_versioned_dataset, get_active_dataset_version, 
+    ensure_admin_table, get_active_dataset_version, 
     get_all_dataset_versions, set_active_dataset_version,_get_latest_file_id,ensure_welcome_table,
+    create_dataset_job, get_dataset_job, get_unfinished_dataset_jobs,
     get_welcome_message,
     update_welcome_message,
-    ensure_quicklink_table, get_active_quicklinks, create_quicklink,update_quicklink,ensure_theme_table,delete_quicklink,get_theme_config,update_theme_config,get_all_conversations_from_db,ensure_appointment_table,save_appointment_to_db_from_lead,get_appointments_from_db,get_appointment_by_id
+    ensure_config_version_table,
+    ensure_quicklink_table, get_active_quicklinks, create_quicklink,update_quicklink,ensure_theme_table,delete_quicklink,get_theme_config,update_theme_config,ensure_appointment_table,save_appointment_to_db_from_lead,get_appointments_from_db,get_appointment_by_id
 )
 
 # Initialize FastAPI app
@@ -86,13 +96,13 @@ def on_startup():
     ensure_quicklink_table()
     ensure_theme_table()
     ensure_appointment_table()
+    ensure_config_version_table()
 
 # --- LLM Configuration ---
 AGENT_NAME = os.getenv("AGENT_NAME", "The Paul Group AI")
 
 # Get the API key from environment variables (set by load_dotenv if from .env file)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 # Check if the key is available before initializing the client
 if not OPENAI_API_KEY:
     print("CRITICAL ERROR: OPENAI_API_KEY is not set. Please ensure it's in your .env file or system environment.")
@@ -100,6 +110,12 @@ if not OPENAI_API_KEY:
 # Choose your desired OpenAI model
 OPENAI_MODEL = "gpt-3.5-turbo" 
 
+# How many of the newest messages /chat loads per turn (0 = the whole conversation)
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "0")) or None
+
+# Leads of users connected over /ws/chat, kept in memory while connected
+chat_sessions = ChatSessionRegistry(history_limit=CHAT_HISTORY_WINDOW)
+
 # Initialize OpenAI client
 client = None # Initialize as None; it will be set if API key is found
 if OPENAI_API_KEY: # Only attempt to initialize if the API key is available
@@ -144,14 +160,7 @@ async def get_openai_response(chat_history: List[Message], system_prompt: str) -
         print("DEBUG: OpenAI client is not initialized, cannot get response for chat.")
         return "I cannot connect to my AI services at the moment. Please inform the administrator."
 
-    messages_for_api = []
-    messages_for_api.append({"role": "system", "content": system_prompt})
-    
-    for msg in chat_history:
-        messages_for_api.append({
-            "role": "user" if msg.sender == "user" else "assistant",
-            "content": msg.text
-        })
+    messages_for_api = _build_openai_messages(chat_history, system_prompt)
         
     try:
         completion = await client.chat.completions.create(
@@ -176,6 +185,70 @@ async def get_openai_response(chat_history: List[Message], system_prompt: str) -
         traceback.print_exc()
         return "An unexpected error occurred with the AI service. Please try again."
 
+def _build_openai_messages(chat_history: List[Message], system_prompt: str) -> List[Dict[str, str]]:
+    messages_for_api = [{"role": "system", "content": system_prompt}]
+    for msg in chat_history:
+        messages_for_api.append({
+            "role": "user" if msg.sender == "user" else "assistant",
+            "content": msg.text
+        })
+    return messages_for_api
+
+async def stream_openai_response(
+    chat_history: List[Message],
+    system_prompt: str,
+    on_token: Callable[[str], Awaitable[None]],
+) -> str:
+    """
+    Streaming variant of get_openai_response: each text delta is passed to
+    `on_token` as it arrives, and the full text is returned at the end.
+    OpenAI errors return the same fallback messages (any tokens already sent
+    stand); exceptions raised by `on_token` propagate to the caller.
+    """
+    if client is None:
+        print("DEBUG: OpenAI client is not initialized, cannot get response for chat.")
+        return "I cannot connect to my AI services at the moment. Please inform the administrator."
+
+    parts: List[str] = []
+    deltas = _openai_deltas(chat_history, system_prompt)
+    try:
+        while True:
+            # Only the OpenAI side is covered by the fallbacks, not the token sink
+            try:
+                delta = await deltas.__anext__()
+            except StopAsyncIteration:
+                break
+            except APIError as e:
+                print(f"ERROR: OpenAI streaming call failed! Status {getattr(e, 'status_code', None)}, Message: {e.message}")
+                return "I'm having trouble connecting to my AI right now. Please try again in a moment."
+            except Exception as e:
+                print(f"ERROR: An unexpected error occurred during OpenAI streaming call: {e}")
+                traceback.print_exc()
+                return "An unexpected error occurred with the AI service. Please try again."
+            parts.append(delta)
+            await on_token(delta)
+    finally:
+        await deltas.aclose()
+
+    text = "".join(parts)
+    print(f"DEBUG: Streamed response from OpenAI: '{text[:100]}...'")
+    return text
+
+async def _openai_deltas(chat_history: List[Message], system_prompt: str):
+    stream = await client.chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=_build_openai_messages(chat_history, system_prompt),
+        temperature=0.7,
+        max_tokens=500,
+        stream=True
+    )
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
 # --- FastAPI Endpoints ---
 
 @app.on_event("startup")
@@ -184,6 +257,22 @@ async def startup_event():
     print("FastAPI application starting up...")
     initialize_sqlite_db()
     print("FastAPI application started. SQLite DB initialized.")
+    orphaned_jobs = await run_db(recover_orphaned_jobs)
+    if orphaned_jobs:
+        print(f"Marked {orphaned_jobs} interrupted dataset job(s) as failed.")
+    preloaded_key = await run_db(preload_persisted_index)
+    if preloaded_key:
+        print(f"Mapped stored FAQ embeddings for {preloaded_key}.")
+    # Build (or page in) the active FAQ index in the background; see /faq-index/status
+    await warm_up_active_index()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stops background dataset jobs, flushes chat sessions and closes pooled SQLite connections."""
+    await dataset_job_runner.shutdown()
+    await chat_sessions.close_all()
+    password_hasher.shutdown()
+    close_all_pools()
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat_with_bot(chat_request: ChatRequest):
@@ -191,13 +280,134 @@ async def chat_with_bot(chat_request: ChatRequest):
     Handles incoming chat messages for anonymous users and implements 
     the lead qualification state machine with recruiting detection.
     """
+    return await run_chat_turn(chat_request)
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_with_bot_stream(chat_request: ChatRequest):
+    """
+    Same turn as /chat, sent as Server-Sent Events.
+
+    `token` events carry LLM text as it is generated (only when the turn falls
+    back to the LLM); a final `done` event carries the full ChatResponse, whose
+    bot_message is authoritative (e.g. when the reply switches to a qualification
+    question). The turn is saved even if the client disconnects mid-stream.
+    """
+    tokens: asyncio.Queue = asyncio.Queue()
+
+    async def streaming_responder(chat_history: List[Message], system_prompt: str) -> str:
+        return await stream_openai_response(chat_history, system_prompt, tokens.put)
+
+    def turn_done(task: asyncio.Task) -> None:
+        tokens.put_nowait(None)
+        # Logged here, not in events(): a client that disconnected never reads the result
+        if not task.cancelled() and (e := task.exception()) is not None:
+            print(f"ERROR: Streamed chat turn for {chat_request.user_id} failed: {e}")
+            traceback.print_exception(type(e), e, e.__traceback__)
+
+    turn = asyncio.create_task(run_chat_turn(chat_request, llm_responder=streaming_responder))
+    turn.add_done_callback(turn_done)
+
+    async def events():
+        while (token := await tokens.get()) is not None:
+            yield _sse("token", {"text": token})
+        try:
+            response = turn.result()
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+        yield _sse("done", response.model_dump(mode="json"))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket, user_id: Optional[str] = None):
+    """
+    Chat over one long-lived connection.
+
+    The client sends {"message": "..."} frames. Each turn streams `token` frames
+    while an LLM reply is generated, then one `message` frame with the reply and
+    lead status (the client already has the history). The lead stays in memory
+    for the connection's lifetime and is written to SQLite in the background.
+    """
+    await websocket.accept()
+    user_id = user_id or f"anon_{int(datetime.now().timestamp())}_{str(uuid.uuid4())[:8]}"
+
+    forwarding = True
+
+    async def send_token(token: str) -> None:
+        nonlocal forwarding
+        if not forwarding:
+            return
+        try:
+            await websocket.send_json({"type": "token", "text": token})
+        except (WebSocketDisconnect, RuntimeError):
+            # Client went away mid-reply: finish generating so the real text is saved
+            forwarding = False
+
+    async def streaming_responder(chat_history: List[Message], system_prompt: str) -> str:
+        return await stream_openai_response(chat_history, system_prompt, send_token)
+
+    session = chat_sessions.acquire(user_id)
+    try:
+        await websocket.send_json({"type": "session", "user_id": user_id})
+        while True:
+            try:
+                payload = json.loads(await websocket.receive_text())
+            except json.JSONDecodeError:
+                payload = None
+            message = payload.get("message") if isinstance(payload, dict) else None
+            if not isinstance(message, str):
+                await websocket.send_json({"type": "error", "detail": "Expected {\"message\": \"...\"}"})
+                continue
+            async with session.lock:
+                response = await run_chat_turn(
+                    ChatRequest(user_id=user_id, message=message),
+                    llm_responder=streaming_responder, session=session
+                )
+            if not forwarding:
+                break            # disconnected mid-reply; the turn is saved, nobody to send it to
+            await websocket.send_json({
+                "type": "message",
+                "bot_message": response.bot_message,
+                "lead_status": response.lead_status,
+                "ticket_number": response.ticket_number,
+                "user_id": user_id,
+            })
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await chat_sessions.release(session)
+
+
+async def run_chat_turn(chat_request: ChatRequest, llm_responder=None,
+                        session: Optional[ChatSession] = None) -> ChatResponse:
+    """
+    One turn of the chat state machine, shared by /chat, /chat/stream and /ws/chat.
+    `llm_responder(history, system_prompt)` replaces get_openai_response when given;
+    with a `session`, the lead comes from and is saved through that session.
+    """
     # UPDATED: Auto-generate user_id if not provided (for anonymous users)
     user_id = chat_request.user_id or f"anon_{int(datetime.now().timestamp())}_{str(uuid.uuid4())[:8]}"
     # user_message = chat_request.message.strip()
     user_message = chat_request.message
     print(user_message,'usermessage')
 
-    lead = await get_lead_from_db(user_id)
+    if session is not None:
+        lead = await session.load()
+        save_lead = session.save
+    else:
+        lead = await get_lead_from_db(user_id, history_limit=CHAT_HISTORY_WINDOW)
+        save_lead = save_lead_to_db
     
     bot_message = ""
     ticket_number = None
@@ -211,7 +421,7 @@ async def chat_with_bot(chat_request: ChatRequest):
         bot_message = ""
         lead.conversation_history.append(Message(sender="bot", text=bot_message))
         lead.last_active_timestamp = datetime.now()
-        await save_lead_to_db(lead)
+        await save_lead(lead)
         
         # UPDATED: Return the initial greeting with the generated user_id
         return ChatResponse(
@@ -225,13 +435,15 @@ async def chat_with_bot(chat_request: ChatRequest):
     # If not a new lead, proceed to add user message and process
     lead.last_active_timestamp = datetime.now()
     lead.conversation_history.append(Message(sender="user", text=user_message))
-    faq_answer = await answer_from_uploaded_file(user_message)
+    # One FAQ lookup per turn; every stage below reuses this result
+    retrieval = await retrieve_faq(user_message)
+    faq_answer = retrieval.answer
 # ____________-___________________________________________
     if faq_answer:
         lead.conversation_history.append(
             Message(sender="bot", text=faq_answer)
         )
-        await save_lead_to_db(lead)
+        await save_lead(lead)
         return ChatResponse(
             bot_message          = faq_answer,
             lead_status          = lead.qualification_stage, 
@@ -250,7 +462,7 @@ async def chat_with_bot(chat_request: ChatRequest):
         bot_message = generate_recruiting_response(user_message)
         
         lead.conversation_history.append(Message(sender="bot", text=bot_message))
-        await save_lead_to_db(lead)
+        await save_lead(lead)
         
         return ChatResponse(
             bot_message=bot_message,
@@ -271,7 +483,7 @@ async def chat_with_bot(chat_request: ChatRequest):
             bot_message = licensing_response
         
         lead.conversation_history.append(Message(sender="bot", text=bot_message))
-        await save_lead_to_db(lead)
+        await save_lead(lead)
         return ChatResponse(
             bot_message=bot_message,
             lead_status=lead.qualification_stage,
@@ -284,7 +496,7 @@ async def chat_with_bot(chat_request: ChatRequest):
     if lead.qualification_stage == "recruiting_completed":
         bot_message = "Thank you for your interest in joining The Paul Group! A recruiter will reach out to you soon. Is there anything else I can help you with today?"
         lead.conversation_history.append(Message(sender="bot", text=bot_message))
-        await save_lead_to_db(lead)
+        await save_lead(lead)
         
         return ChatResponse(
             bot_message=bot_message,
@@ -306,13 +518,13 @@ async def chat_with_bot(chat_request: ChatRequest):
         #         lead.qualification_stage = "ask_name"
         #         bot_message = QUALIFICATION_QUESTIONS[lead.qualification_stage]
         else:
-            # NEW: Try to get answer from uploaded dataset first
-            dataset_answer = await answer_from_uploaded_file(user_message)
+            # NEW: Try to get answer from uploaded dataset first (looked up once above)
+            dataset_answer = retrieval.answer
             if dataset_answer:
                 bot_message = dataset_answer.strip()
             else:
                 # Fallback to OpenAI if no dataset match found
-                bot_message = await get_openai_response(lead.conversation_history, GENERAL_CHAT_SYSTEM_PROMPT)
+                bot_message = await (llm_responder or get_openai_response)(lead.conversation_history, GENERAL_CHAT_SYSTEM_PROMPT)
             
             # Check if we should transition to qualification
             if "explore options" in bot_message.lower() or "personalized quote" in bot_message.lower():
@@ -344,7 +556,7 @@ async def chat_with_bot(chat_request: ChatRequest):
             
             if "couldn't find a valid age" in bot_message or "Please provide a realistic age" in bot_message:
                 lead.conversation_history.pop()
-                await save_lead_to_db(lead)
+                await save_lead(lead)
                 return ChatResponse(
                     bot_message=bot_message,
                     lead_status=lead.qualification_stage,
@@ -355,7 +567,7 @@ async def chat_with_bot(chat_request: ChatRequest):
         except (ValueError, AttributeError):
             bot_message = "I couldn't understand your age. Please provide your age as a number. For example, 'I am 65'."
             lead.conversation_history.pop()
-            await save_lead_to_db(lead)
+            await save_lead(lead)
             return ChatResponse(
                 bot_message=bot_message,
                 lead_status=lead.qualification_stage,
@@ -383,7 +595,7 @@ async def chat_with_bot(chat_request: ChatRequest):
         else:
             bot_message = "Please answer with 'Yes' or 'No' regarding major health conditions. (e.g., 'Yes', 'No, I have diabetes')"
             lead.conversation_history.pop() 
-            await save_lead_to_db(lead)
+            await save_lead(lead)
             return ChatResponse(
                 bot_message=bot_message,
                 lead_status=lead.qualification_stage,
@@ -403,7 +615,7 @@ async def chat_with_bot(chat_request: ChatRequest):
         if not is_valid:
             bot_message = "I couldn't understand your budget amount. Please tell me how much you'd like to spend per month. For example: '$55', '$75', or 'around $100'."
             lead.conversation_history.pop()
-            await save_lead_to_db(lead)
+            await save_lead(lead)
             return ChatResponse(
                 bot_message=bot_message,
                 lead_status=lead.qualification_stage,
@@ -440,7 +652,7 @@ async def chat_with_bot(chat_request: ChatRequest):
             available_slots_text = '\n'.join(lead.available_slots or [])
             bot_message = f"Please select one of the available time slots by choosing a number (1, 2, 3, 4) or mentioning the specific time:\n\n{available_slots_text}"
             lead.conversation_history.pop()
-            await save_lead_to_db(lead)
+            await save_lead(lead)
             return ChatResponse(
                 bot_message=bot_message,
                 lead_status=lead.qualification_stage,
@@ -462,7 +674,7 @@ async def chat_with_bot(chat_request: ChatRequest):
             lead.ticket_number = ticket_number
             # Save booking date = today’s date + selected slot
             try:
-                _appt_id = save_appointment_to_db_from_lead(lead)
+                _appt_id = await run_db(save_appointment_to_db_from_lead, lead)
             except Exception as e:
                 print(f"ERROR saving appointment: {e}")
 
@@ -476,7 +688,7 @@ async def chat_with_bot(chat_request: ChatRequest):
         else:
             bot_message = "Please confirm with 'Yes' to book this time slot, or 'No' to choose a different time."
             lead.conversation_history.pop()
-            await save_lead_to_db(lead)
+            await save_lead(lead)
             return ChatResponse(
                 bot_message=bot_message,
                 lead_status=lead.qualification_stage,
@@ -499,7 +711,7 @@ async def chat_with_bot(chat_request: ChatRequest):
        "Please confirm with 'Yes'" not in bot_message:
         lead.conversation_history.append(Message(sender="bot", text=bot_message))
     
-    await save_lead_to_db(lead)
+    await save_lead(lead)
 
     # UPDATED: Always return user_id in the response
     return ChatResponse(
@@ -521,21 +733,86 @@ async def get_lead_data(user_id: str):
         raise HTTPException(status_code=404, detail="Lead not found")
     return lead.model_dump(mode="json")
 
+# Leads decoded per query when streaming NDJSON
+LEADS_STREAM_BATCH = 200
+
+
+class LeadListQuery:
+    """
+    Query parameters shared by the lead and conversation listings.
+
+    Leads come newest-first by last_active_timestamp. With `limit`, one page is
+    returned and the `X-Next-Cursor` header carries the `cursor` for the next
+    one (absent on the last page). `format=ndjson` streams every matching row,
+    one JSON object per line, decoding LEADS_STREAM_BATCH leads at a time.
+    """
+
+    def __init__(
+        self,
+        stage: Optional[LeadQualificationStage] = None,
+        recruiting: Optional[bool] = None,
+        active_since: Optional[datetime] = None,
+        active_until: Optional[datetime] = None,
+        limit: Optional[int] = Query(None, ge=1, le=LEADS_PAGE_MAX),
+        cursor: Optional[str] = None,
+        format: Literal["json", "ndjson"] = "json",
+    ):
+        self.filters = {"stage": stage, "recruiting": recruiting,
+                        "active_since": active_since, "active_until": active_until}
+        self.limit = limit
+        self.after = _decode_lead_cursor(cursor) if cursor else None
+        self.format = format
+
+
+def _encode_lead_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+
+def _decode_lead_cursor(cursor: str) -> tuple:
+    try:
+        last_active, lead_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(last_active), str(lead_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _list_leads(query: LeadListQuery, response: Response, serialize: Callable[[Lead], Dict]):
+    if query.format == "ndjson":
+        async def lines():
+            async for lead in iter_leads(LEADS_STREAM_BATCH, after=query.after, **query.filters):
+                yield orjson.dumps(serialize(lead)) + b"\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    leads, last_key = await get_leads_page(query.limit, query.after, **query.filters)
+    if query.limit is not None and len(leads) == query.limit:
+        response.headers["X-Next-Cursor"] = _encode_lead_cursor(last_key)
+    return [serialize(lead) for lead in leads]
+
+
+def _lead_json(lead: Lead) -> Dict:
+    return lead.model_dump(mode="json")
+
+
+def _conversation_json(lead: Lead) -> Dict:
+    return {"id": lead.id, "conversation_history": [m.model_dump(mode="json") for m in lead.conversation_history]}
+
+
 @app.get("/admin/all_leads", response_model=List[Lead])
-async def get_all_leads_admin_view():
-    """Admin endpoint to view all leads in the database."""
-    leads = await get_all_leads_from_db()
-    return [lead.model_dump(mode="json") for lead in leads]
+async def get_all_leads_admin_view(response: Response, query: LeadListQuery = Depends()):
+    """Admin endpoint to view leads in the database (filterable, paginated or streamed)."""
+    return await _list_leads(query, response, _lead_json)
 
 @app.get("/admin/recruiting_leads", response_model=List[Lead])
-async def get_recruiting_leads_admin_view():
-    """Admin endpoint to view all recruiting inquiry leads in the database."""
-    recruiting_leads = await get_recruiting_leads_from_db()
-    return [lead.model_dump(mode="json") for lead in recruiting_leads]
+async def get_recruiting_leads_admin_view(response: Response, query: LeadListQuery = Depends()):
+    """Admin endpoint to view recruiting inquiry leads in the database."""
+    query.filters["recruiting"] = True
+    return await _list_leads(query, response, _lead_json)
 
 
 CHUNK_SIZE = 1000  
 DATASET_DIR = "Webchat_dataset"
+# Uploads are ingested in the background; job state lives in the dataset_jobs table
+dataset_job_runner = DatasetJobRunner()
 
 # @app.post("/upload-dataset/")
 # async def upload_dataset(file: UploadFile = File(...)):
@@ -588,6 +865,10 @@ DATASET_DIR = "Webchat_dataset"
 def get_current_admin(
     cred: HTTPAuthorizationCredentials = Security(security)
 ):
+    admin = admin_principals.get(cred.credentials)
+    if admin is not None:
+        return admin
+
     payload = decode_token(cred.credentials)
     if not payload or "sub" not in payload:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
@@ -595,6 +876,10 @@ def get_current_admin(
     admin = get_admin_by_email(payload["sub"])
     if not admin:
         raise HTTPException(status_code=401, detail="Admin not found")
+    # Tokens issued before the last password change carry an older version
+    if payload.get("tv", 0) != admin["token_version"]:
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    admin_principals.put(cred.credentials, admin, payload.get("exp"))
     return admin
 
 #same api change the algo and urlname
@@ -615,83 +900,43 @@ async def upload_dataset_version(
             }
 
         # ✅ Check if version already exists
-        versions = get_all_dataset_versions()
+        versions = await run_db(get_all_dataset_versions)
         if any(v["version"] == version_label for v in versions):
             return {
                 "status": "error",
                 "message": f"Version {version_label} already exists."
             }
+        if any(job["version_label"] == version_label for job in await run_db(get_unfinished_dataset_jobs)):
+            return {
+                "status": "error",
+                "message": f"Version {version_label} is already being uploaded."
+            }
 
+        # ✅ Spool the body to disk; chunking, upload and indexing run as a background job
         os.makedirs(DATASET_DIR, exist_ok=True)
-
-        # Save uploaded file temporarily
-        filepath = f"{DATASET_DIR}/{file.filename}"
-        async with aiofiles.open(filepath, 'wb') as out_file:
-            content = await file.read()
-            await out_file.write(content)
-
-        # ✅ Read & validate JSON file
-        try:
-            async with aiofiles.open(filepath, "r", encoding="utf-8") as f:
-                content = await f.read()
-                data = json.loads(content)
-        except json.JSONDecodeError:
-            os.remove(filepath)  # cleanup
+        job_id = uuid.uuid4().hex
+        source_path = os.path.join(DATASET_DIR, f"job_{job_id}.json")
+        async with aiofiles.open(source_path, "wb") as out_file:
+            while data := await file.read(1024 * 1024):
+                await out_file.write(data)
+
+        # Re-checked atomically: another upload of the same label may have been queued meanwhile
+        if await run_db(create_dataset_job, job_id, version_label, description, source_path, admin["email"]) is None:
+            os.remove(source_path)
             return {
                 "status": "error",
-                "message": "Uploaded file is not a valid JSON."
+                "message": f"Version {version_label} is already being uploaded."
             }
-
-        total_records = len(data)
-        chunk_files = []
-
-        # ✅ Split into chunks
-        for i in range(0, len(data), CHUNK_SIZE):
-            chunk = data[i:i+CHUNK_SIZE]
-            chunk_file_path = f"{DATASET_DIR}/{version_label}_chunk_{i//CHUNK_SIZE + 1}.jsonl"
-
-            async with aiofiles.open(chunk_file_path, "w", encoding="utf-8") as out:
-                for record in chunk:
-                    prompt = record.get("user_input", "")
-                    completion = " " + record.get("bot_response", "")
-                    await out.write(json.dumps({"prompt": prompt, "completion": completion}) + "\n")
-
-            chunk_files.append(chunk_file_path)
-
-        # ✅ Upload each chunk to OpenAI
-        uploaded_files = []
-        for chunk_path in chunk_files:
-            async with aiofiles.open(chunk_path, "rb") as f:
-                file_data = await f.read()
-
-            response = await client.files.create(
-                file=(os.path.basename(chunk_path), file_data),
-                purpose='fine-tune'
-            )
-            uploaded_files.append(response.id)
-
-        # ✅ Store versioned dataset
-        store_versioned_dataset(
-            version_label=version_label,
-            description=description,
-            file_ids=uploaded_files,
-            total_records=total_records,
-            created_by=admin["email"]
-        )
-
-        # ✅ Clean up temp files
-        for chunk_path in chunk_files:
-            os.remove(chunk_path)
-        os.remove(filepath)
+        dataset_job_runner.submit(job_id, lambda: ingest_dataset(
+            job_id, client, source_path, version_label, description, admin["email"], CHUNK_SIZE,
+        ))
 
         return {
-            "status": "success",
+            "status": "queued",
+            "job_id": job_id,
             "version": version_label,
-            "description": description,
-            "total_records": total_records,
-            "uploaded_files": uploaded_files,
-            "chunks_created": len(chunk_files),
-            "message": f"Dataset version {version_label} uploaded and activated"
+            "status_url": f"/dataset-jobs/{job_id}",
+            "message": f"Dataset version {version_label} accepted; it is activated when the job completes"
         }
 
     except Exception as e:
@@ -700,11 +945,22 @@ async def upload_dataset_version(
             "message": f"An unexpected error occurred: {str(e)}"
         }
 
+@app.get("/dataset-jobs/{job_id}")
+async def get_dataset_job_status(job_id: str, admin: dict = Depends(get_current_admin)):
+    """Status, stage and progress counters of a dataset upload job."""
+    job = await run_db(get_dataset_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Dataset job {job_id} not found")
+    job.pop("source_path", None)
+    job.pop("worker_pid", None)
+    return job
+
+
 @app.get("/dataset-versions/")
 async def list_dataset_versions():
     """List all dataset versions (no auth required for viewing)."""
-    versions = get_all_dataset_versions()
-    active_version = get_active_dataset_version()
+    versions = await run_db(get_all_dataset_versions)
+    active_version = await run_db(get_active_dataset_version)
     
     return {
         "versions": versions,
@@ -720,10 +976,12 @@ async def switch_dataset_version(
 ):
     """Switch to a different dataset version."""
     
-    if not set_active_dataset_version(version_label):
+    if not await run_db(set_active_dataset_version, version_label):
         raise HTTPException(status_code=404, detail=f"Version {version_label} not found")
+    # Warm the new version's index in the background; the previous one answers until it is ready
+    await warm_up_active_index()
     
-    active_version = get_active_dataset_version()
+    active_version = await run_db(get_active_dataset_version)
     
     return {
         "status": "success",
@@ -732,14 +990,27 @@ async def switch_dataset_version(
     }
 
 
+@app.get("/faq-metrics")
+async def faq_metrics():
+    """Query-embedding cache hit rate and in-memory FAQ index usage for this worker."""
+    return get_faq_metrics()
+
+
+@app.get("/faq-index/status")
+async def faq_index_status():
+    """Readiness probe for FAQ retrieval: 200 once the active version's index is hot, else 503."""
+    index_status = await get_index_status()
+    return JSONResponse(status_code=200 if index_status["ready"] else 503, content=index_status)
+
+
 @app.get("/active-dataset-version/")
 async def get_current_active_version():
     """Get currently active dataset version info."""
-    active = get_active_dataset_version()
+    active = await run_db(get_active_dataset_version)
     
     if not active:
         # Fallback to old system
-        file_id = _get_latest_file_id()  # Your existing function
+        file_id = await run_db(_get_latest_file_id)  # Your existing function
         if file_id:
             return {
                 "version": "legacy",
@@ -753,49 +1024,94 @@ async def get_current_active_version():
     return active
 
 
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+
+def _client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+
+def _raise_if_throttled(*checks) -> None:
+    """429 with Retry-After if any (throttle, key) pair is over its limit."""
+    for throttle, key in checks:
+        wait = throttle.retry_after(key)
+        if wait > 0:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many attempts. Please try again later.",
+                headers={"Retry-After": str(int(wait) + 1)}
+            )
+
+
 @app.post("/register")
-def register_admin(
+async def register_admin(
+    request: Request,
     email: str = Form(...),
     password: str = Form(...)
 ):
-    ensure_admin_table()
-    if get_admin_by_email(email):
+    ip = _client_ip(request)
+    _raise_if_throttled((ip_throttle, ip))
+
+    await run_db(ensure_admin_table)
+    if await run_db(get_admin_by_email, email):
+        ip_throttle.hit(ip)
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    admin = create_admin(email, hash_password(password))
+    admin = await run_db(create_admin, email, await hash_password_async(password))
     return {"id": admin["id"], "email": admin["email"], "message": "Admin registered"}
 
 
 @app.post("/login")
-def login_admin(
+async def login_admin(
+    request: Request,
     email: str = Form(...),
     password: str = Form(...)
 ):
-    admin = get_admin_by_email(email)
-    if not admin or not verify_password(password, admin["password"]):
+    ip, email_key = _client_ip(request), email.lower()
+    _raise_if_throttled((ip_throttle, ip), (email_throttle, email_key))
+
+    admin = await run_db(get_admin_by_email, email)
+    if not admin or not await verify_password_async(password, admin["password"]):
+        ip_throttle.hit(ip)
+        email_throttle.hit(email_key)
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    email_throttle.reset(email_key)
 
-    token = create_access_token({"sub": admin["email"]})
-    token = create_access_token({"sub": admin["email"]}, minutes=120)
+    token = create_access_token({"sub": admin["email"], "tv": admin["token_version"]}, minutes=120)
     return {"access_token": token, "token_type": "bearer", "message": "Admin login successfully"}
 
 
 @app.post("/update-password")
-def update_password(
+async def update_password(
     old_password: str = Form(...),
     new_password: str = Form(...),
     admin: dict = Depends(get_current_admin)
 ):
-    if not verify_password(old_password, admin["password"]):
+    # The cached principal may predate a change made on another worker
+    admin = await run_db(get_admin_by_email, admin["email"])
+    if not admin or not await verify_password_async(old_password, admin["password"]):
         raise HTTPException(status_code=400, detail="Old password is incorrect")
 
-    update_admin_password(admin["id"], hash_password(new_password))
+    await run_db(update_admin_password, admin["id"], await hash_password_async(new_password))
+    admin_principals.invalidate(admin["email"])
     return {"message": "Password updated successfully"}
 
 
+@app.get("/auth-metrics")
+def auth_metrics(admin: dict = Depends(get_current_admin)):
+    """bcrypt pool queue depth and login throttling counters for this worker."""
+    return {
+        "password_hasher": password_hasher.metrics(),
+        "ip_throttle": ip_throttle.metrics(),
+        "email_throttle": email_throttle.metrics(),
+    }
+
+
 @app.get("/get-welcome-message")
 def read_welcome_message():
-    return {"message": get_welcome_message()}
+    return {"message": config_cache.get("welcome_message", get_welcome_message)}
  
  
 @app.post("/welcome-message")
@@ -806,13 +1122,14 @@ def write_welcome_message(
     if not message.strip():
         raise HTTPException(status_code=400, detail="Message cannot be empty")
     update_welcome_message(message)
+    config_cache.invalidate()
     return {"message": "Welcome message updated successfully"}
 
 
 
 @app.get("/quick-links")
 def read_quick_links():
-    return {"quick_links": get_active_quicklinks()}
+    return {"quick_links": config_cache.get("quick_links", get_active_quicklinks)}
  
  
 @app.post("/quick-links")
@@ -825,6 +1142,7 @@ def add_quick_link(
         raise HTTPException(status_code=400, detail="Title and description are required")
    
     create_quicklink(title, description)
+    config_cache.invalidate()
     return {"message": "Quick link created"}
  
 @app.put("/quick-links/{link_id}")
@@ -838,6 +1156,7 @@ def edit_quick_link(
         raise HTTPException(status_code=400, detail="Title and description are required")
  
     success = update_quicklink(link_id, title, description)
+    config_cache.invalidate()
     if not success:
         raise HTTPException(status_code=404, detail="Quick link not found")
  
@@ -849,16 +1168,54 @@ def delete_quick_link(
     admin: dict = Depends(get_current_admin)
 ):
     success = delete_quicklink(link_id)
+    config_cache.invalidate()
     if not success:
         raise HTTPException(status_code=404, detail="Quick link not found")
  
     return {"message": "Quick link deleted successfully"}
 
 
+# Browsers and CDNs may reuse /widget-bootstrap this long before revalidating with its ETag
+WIDGET_BOOTSTRAP_MAX_AGE = int(os.getenv("WIDGET_BOOTSTRAP_MAX_AGE", "60"))
+
+
+def _build_widget_bootstrap() -> tuple:
+    """(body, etag) for /widget-bootstrap, serialized once per config generation."""
+    body = orjson.dumps({
+        "theme": config_cache.get("theme", get_theme_config),
+        "welcome_message": config_cache.get("welcome_message", get_welcome_message),
+        "quick_links": config_cache.get("quick_links", get_active_quicklinks),
+    })
+    return body, f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # If-None-Match uses weak comparison, so a W/ prefix added by a proxy still matches
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+@app.get("/widget-bootstrap")
+def widget_bootstrap(if_none_match: Optional[str] = Header(None)):
+    """
+    Theme, welcome message and quick links in one response.
+
+    The body and its strong ETag are computed once per config generation, so a
+    request costs a dictionary lookup; a matching If-None-Match gets an empty 304.
+    """
+    body, etag = config_cache.get("widget_bootstrap", _build_widget_bootstrap)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={WIDGET_BOOTSTRAP_MAX_AGE}"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @app.get("/theme-config")
 def read_theme_config():
     try:
-        return {"status":"sucess","theme": get_theme_config()}
+        return {"status":"sucess","theme": config_cache.get("theme", get_theme_config)}
     except Exception as e:
         return {"status":"failed","message":str(e)}
 
@@ -888,7 +1245,7 @@ async def write_theme_config(
     admin: dict = Depends(get_current_admin)
 ):
     # Get existing config so we can keep values if not provided
-    existing_config = get_theme_config()
+    existing_config = await run_db(get_theme_config)
 
     # Handle file upload
     avatar_image_url = existing_config.get("avatar_image_url")
@@ -926,7 +1283,8 @@ async def write_theme_config(
         "heading_font_weight": heading_font_weight.strip() if heading_font_weight else existing_config.get("heading_font_weight")
     }
 
-    update_theme_config(data)
+    await run_db(update_theme_config, data)
+    config_cache.invalidate()
 
     return JSONResponse(
         status_code=200,
@@ -939,13 +1297,13 @@ async def write_theme_config(
 
 
 @app.get("/conversations", response_model=List[dict])
-async def get_conversations():
+async def get_conversations(response: Response, query: LeadListQuery = Depends()):
     """
-    Returns all conversations from the leads table.
+    Returns conversations from the leads table, with the same filters,
+    pagination and NDJSON streaming as /admin/all_leads.
     """
     try:
-        conversations = await get_all_conversations_from_db()
-        return conversations
+        return await _list_leads(query, response, _conversation_json)
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
@@ -956,18 +1314,14 @@ async def get_conversation(conversation_id: str):
     Returns a single conversation for the given conversation_id (lead.id).
     """
     try:
-        leads = await get_all_leads_from_db()
-
-        # find the matching lead
-        for lead in leads:
-            if str(lead.id) == str(conversation_id):
-                return {
-                    "id": lead.id,
-                    "conversation_history": lead.conversation_history
-                }
-
-        # If not found
-        return JSONResponse(status_code=404, content={"error": "Conversation not found"})
+        lead = await get_lead_from_db(conversation_id)
+        if lead is None:
+            return JSONResponse(status_code=404, content={"error": "Conversation not found"})
+
+        return {
+            "id": lead.id,
+            "conversation_history": lead.conversation_history
+        }
 
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
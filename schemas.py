@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, ValidationError
+from pydantic import BaseModel, Field, ValidationError, PrivateAttr
 from datetime import datetime
 from typing import List, Optional, Literal, Dict
 import uuid
@@ -52,6 +52,11 @@ class Lead(BaseModel):
     # New field for recruiting inquiries (optional, mainly for database tracking)
     is_recruiting_inquiry: Optional[bool] = False
 
+    # Storage bookkeeping for the append-only `messages` table (not part of the API payload):
+    # seq of conversation_history[0], and how many seqs are already persisted.
+    _history_offset: int = PrivateAttr(default=0)
+    _persisted_seq: int = PrivateAttr(default=0)
+
 # Request model for incoming chat messages - UPDATED for anonymous users
 class ChatRequest(BaseModel):
     user_id: Optional[str] = Field(None, description="Optional user identifier - will be auto-generated if not provided")
@@ -1,14 +1,20 @@
 import sqlite3
 import json,re,os
-from typing import List, Optional, Dict
+from typing import AsyncIterator, List, Optional, Dict, Tuple
 from schemas import Lead, Message, LeadQualificationStage # Updated import
 from datetime import datetime
+from db_pool import get_pool, run_db
 
 
 
 DATABASE_FILE = "leads.db" 
 
 
+def _db():
+    """Check a pooled connection out for DATABASE_FILE (use as a context manager)."""
+    return get_pool(DATABASE_FILE).connection()
+
+
 # Recruiting keywords and phrases
 RECRUITING_KEYWORDS = [
     "sales position", "are you hiring", "looking for a job", "want to join your team",
@@ -40,69 +46,137 @@ NOT_LICENSED_RESPONSE = "No worries — we help people get licensed and start ea
 
 def migrate_database():
     """Adds missing columns to existing database for backward compatibility."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    
-    try:
-        # Check if is_recruiting_inquiry column exists
-        cursor.execute("PRAGMA table_info(leads)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'is_recruiting_inquiry' not in columns:
-            print("Adding is_recruiting_inquiry column to existing database...")
-            cursor.execute('ALTER TABLE leads ADD COLUMN is_recruiting_inquiry BOOLEAN DEFAULT FALSE')
-            conn.commit()
-            print("Database migration completed successfully.")
-        if 'available_slots' not in columns:
-            print("Adding available_slots column to existing database...")
-            cursor.execute('ALTER TABLE leads ADD COLUMN available_slots TEXT')
-            conn.commit()
-        if 'selected_time_slot' not in columns:
-            print("Adding selected_time_slot column to existing database...")
-            cursor.execute('ALTER TABLE leads ADD COLUMN selected_time_slot TEXT')
-            conn.commit()
-            print("Time slot columns added successfully.")
-        else:
-            print("Database is already up to date.")
-            
-    except sqlite3.Error as e:
-        print(f"Error during database migration: {e}")
-    finally:
-        conn.close()
+    with _db() as conn:
+        cursor = conn.cursor()
+
+        try:
+            # Check if is_recruiting_inquiry column exists
+            cursor.execute("PRAGMA table_info(leads)")
+            columns = [column[1] for column in cursor.fetchall()]
+
+            if 'is_recruiting_inquiry' not in columns:
+                print("Adding is_recruiting_inquiry column to existing database...")
+                cursor.execute('ALTER TABLE leads ADD COLUMN is_recruiting_inquiry BOOLEAN DEFAULT FALSE')
+                conn.commit()
+                print("Database migration completed successfully.")
+            if 'available_slots' not in columns:
+                print("Adding available_slots column to existing database...")
+                cursor.execute('ALTER TABLE leads ADD COLUMN available_slots TEXT')
+                conn.commit()
+            if 'selected_time_slot' not in columns:
+                print("Adding selected_time_slot column to existing database...")
+                cursor.execute('ALTER TABLE leads ADD COLUMN selected_time_slot TEXT')
+                conn.commit()
+                print("Time slot columns added successfully.")
+            else:
+                print("Database is already up to date.")
+
+        except sqlite3.Error as e:
+            print(f"Error during database migration: {e}")
 
 
 def initialize_sqlite_db():
     """Initializes the SQLite database and creates the leads table if it doesn't exist."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS leads (
-            id TEXT PRIMARY KEY,
-            phone_number TEXT,
-            full_name TEXT,
-            age INTEGER,
-            state_of_residence TEXT,
-            general_health TEXT,
-            health_conditions TEXT, 
-            budget_range TEXT,
-            available_slots TEXT,         
-            selected_time_slot TEXT,
-            best_contact_time TEXT,
-            qualification_stage TEXT NOT NULL, -- Changed from 'status'
-            conversation_history TEXT NOT NULL, -- Stored as JSON string
-            last_active_timestamp TEXT NOT NULL, -- Stored as ISO format string
-            ticket_number TEXT, -- New field
-            is_recruiting_inquiry BOOLEAN DEFAULT FALSE -- New field for recruiting inquiries
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    with _db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS leads (
+                id TEXT PRIMARY KEY,
+                phone_number TEXT,
+                full_name TEXT,
+                age INTEGER,
+                state_of_residence TEXT,
+                general_health TEXT,
+                health_conditions TEXT,
+                budget_range TEXT,
+                available_slots TEXT,
+                selected_time_slot TEXT,
+                best_contact_time TEXT,
+                qualification_stage TEXT NOT NULL, -- Changed from 'status'
+                conversation_history TEXT NOT NULL, -- Stored as JSON string
+                last_active_timestamp TEXT NOT NULL, -- Stored as ISO format string
+                ticket_number TEXT, -- New field
+                is_recruiting_inquiry BOOLEAN DEFAULT FALSE -- New field for recruiting inquiries
+            )
+        ''')
+        # Conversation history, one row per message (appended, never rewritten)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                lead_id TEXT NOT NULL,
+                seq INTEGER NOT NULL, -- 0-based position in the conversation
+                sender TEXT NOT NULL,
+                text TEXT NOT NULL,
+                timestamp TEXT NOT NULL, -- Stored as ISO format string
+                PRIMARY KEY (lead_id, seq)
+            ) WITHOUT ROWID
+        ''')
+        # Admin lead listings page newest-first by (last_active_timestamp, id)
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_leads_last_active ON leads (last_active_timestamp DESC, id DESC)
+        ''')
+        conn.commit()
+    ensure_dataset_jobs_table()
     print("SQLite database initialized.")
     
     # Run migration to add any missing columns to existing databases
     migrate_database()
 
 
+# Pattern rules for common recruiting phrases, as (rule name, leading words, remainder).
+# Each rule is the regex r'\b(<leading words>)' + remainder. The leading words are compiled
+# as literals followed by a look-behind word-boundary check, which lets the regex engine
+# jump straight to candidate positions instead of testing `\b` at every character.
+RECRUITING_PATTERN_RULES = [
+    ("job_then_sales",    ["job", "work", "position", "career", "opportunity", "hiring"], r'\b.*\b(insurance|sales|agent)\b'),
+    ("sales_then_job",    ["insurance", "sales", "agent"], r'\b.*\b(job|work|position|career|opportunity)\b'),
+    ("licensed_agent",    ["licensed", "license"], r'\b.*\b(insurance|life insurance|agent)\b'),
+    ("get_licensed",      ["get licensed"], r'\b'),
+    ("join_team",         ["join"], r'.*team\b'),
+    ("work_with_you",     ["work"], r'.*with.*you\b'),
+    ("hiring_agents",     ["hiring"], r'.*agents?\b'),
+    ("agent_position",    ["agent"], r'.*position\b'),
+    ("sales_opportunity", ["sales"], r'.*opportunity\b'),
+]
+
+
+def _compile_pattern_rule(leading_words: List[str], remainder: str) -> "re.Pattern":
+    # `\bword` == `word(?<!\wword)` because every leading word starts with a word character
+    leading = '|'.join(f'{re.escape(w)}(?<!\\w{re.escape(w)})' for w in leading_words)
+    return re.compile(f'(?:{leading}){remainder}')
+
+
+# Compiled once at import: one alternation for all keywords (a single scan of the message)
+# and one regex per pattern rule.
+_RECRUITING_KEYWORD_RE = re.compile('|'.join(re.escape(k) for k in RECRUITING_KEYWORDS))
+_RECRUITING_PATTERN_RES = [
+    (name, _compile_pattern_rule(words, remainder))
+    for name, words, remainder in RECRUITING_PATTERN_RULES
+]
+
+
+def match_recruiting_rule(message: str) -> Optional[str]:
+    """
+    Returns the recruiting rule a message triggers, or None.
+
+    Args:
+        message (str): The incoming message to analyze
+
+    Returns:
+        Optional[str]: "keyword:<keyword>" or "pattern:<rule name>" for the first rule that fired
+    """
+    message_lower = message.lower().strip()
+
+    keyword_match = _RECRUITING_KEYWORD_RE.search(message_lower)
+    if keyword_match:
+        return f"keyword:{keyword_match.group()}"
+
+    for name, pattern in _RECRUITING_PATTERN_RES:
+        if pattern.search(message_lower):
+            return f"pattern:{name}"
+
+    return None
+
+
 def detect_recruiting_inquiry(message: str) -> bool:
     """
     Detects if a message contains recruiting-related keywords or phrases.
@@ -113,31 +187,7 @@ def detect_recruiting_inquiry(message: str) -> bool:
     Returns:
         bool: True if recruiting keywords are detected, False otherwise
     """
-    message_lower = message.lower().strip()
-    
-    # Check for direct keyword matches
-    for keyword in RECRUITING_KEYWORDS:
-        if keyword in message_lower:
-            return True
-    
-    # Additional pattern matching for common recruiting phrases
-    recruiting_patterns = [
-        r'\b(job|work|position|career|opportunity|hiring)\b.*\b(insurance|sales|agent)\b',
-        r'\b(insurance|sales|agent)\b.*\b(job|work|position|career|opportunity)\b',
-        r'\blicensed?\b.*\b(insurance|life insurance|agent)\b',
-        r'\bget licensed\b',
-        r'\bjoin.*team\b',
-        r'\bwork.*with.*you\b',
-        r'\bhiring.*agents?\b',
-        r'\bagent.*position\b',
-        r'\bsales.*opportunity\b'
-    ]
-    
-    for pattern in recruiting_patterns:
-        if re.search(pattern, message_lower):
-            return True
-    
-    return False
+    return match_recruiting_rule(message) is not None
 
 
 def generate_recruiting_response(message: str = None) -> str:
@@ -199,23 +249,22 @@ def handle_licensing_status_response(message: str) -> str:
 
 
 async def save_lead_to_db(lead: Lead):
-    """Saves or updates a lead document in SQLite."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    """
+    Saves or updates a lead in SQLite.
 
+    Only the lead's own columns are rewritten; conversation messages that are
+    not yet stored are appended to the `messages` table, so a turn costs the
+    same regardless of how long the conversation already is.
+    """
+    await run_db(_save_lead_sync, lead)
+    print(f"Lead {lead.id} saved/updated in SQLite.")
 
-    lead_dict = lead.model_dump(exclude_none=True) # exclude_none=True will help with optional fields
-    
-    serialized_history = []
-    for msg in lead.conversation_history:
-        msg_dict = msg.model_dump()
-        # Convert datetime objects within Message to ISO format strings
-        msg_dict['timestamp'] = msg_dict['timestamp'].isoformat() 
-        serialized_history.append(msg_dict)
-    
-    # Dump the list of dictionaries (with string timestamps) to a JSON string
-    lead_dict['conversation_history'] = json.dumps(serialized_history) 
 
+def _save_lead_sync(lead: Lead):
+    lead_dict = lead.model_dump(exclude={'conversation_history'}, exclude_none=True) # exclude_none=True will help with optional fields
+
+    # History lives in the messages table now; keep the legacy NOT NULL column empty
+    lead_dict['conversation_history'] = '[]'
 
     # Serialize last_active_timestamp to ISO format string
     lead_dict['last_active_timestamp'] = lead_dict['last_active_timestamp'].isoformat()
@@ -227,226 +276,284 @@ async def save_lead_to_db(lead: Lead):
         lead_dict['available_slots'] = None
 
 
-    # Check if this lead has recruiting inquiries in their conversation history
-    is_recruiting_inquiry = any(
-        detect_recruiting_inquiry(msg.text) 
-        for msg in lead.conversation_history 
+    offset = lead._history_offset
+    history_end = offset + len(lead.conversation_history)
+    persisted = lead._persisted_seq
+    truncated = history_end < persisted
+    if truncated:
+        persisted = history_end
+    new_messages = lead.conversation_history[persisted - offset:]
+
+    # Recruiting flag is sticky: only messages not seen by an earlier save need checking
+    if not lead.is_recruiting_inquiry and any(
+        detect_recruiting_inquiry(msg.text)
+        for msg in new_messages
         if msg.sender == "user"
-    )
-    lead_dict['is_recruiting_inquiry'] = is_recruiting_inquiry
+    ):
+        lead.is_recruiting_inquiry = True
+    lead_dict['is_recruiting_inquiry'] = bool(lead.is_recruiting_inquiry)
+
+    # Prepare values, ensuring None for missing optional fields
+    values = [lead_dict.get(col) for col in LEAD_COLUMNS]
+
+    with _db() as conn:
+        conn.execute(_SAVE_LEAD_SQL, values)
+
+        # Messages removed after they were stored (e.g. a popped retry) are dropped
+        if truncated:
+            conn.execute('DELETE FROM messages WHERE lead_id = ? AND seq >= ?', (lead.id, history_end))
+
+        rows = [
+            (lead.id, persisted + i, msg.sender, msg.text, msg.timestamp.isoformat())
+            for i, msg in enumerate(new_messages)
+        ]
+        if conn.executemany(_INSERT_MESSAGE_SQL, rows).rowcount < len(rows):
+            _append_displaced_messages(conn, rows)
+        conn.commit()
+
+    lead._persisted_seq = history_end
 
 
-    # Define all column names and their corresponding values in order
-    columns = [
+# Define all column names and their corresponding values in order
+LEAD_COLUMNS = [
     "id", "phone_number", "full_name", "age", "state_of_residence", 
     "general_health", "health_conditions", "budget_range", 
     "available_slots", "selected_time_slot", "best_contact_time",  # FIXED: Match CREATE TABLE order
     "qualification_stage", "conversation_history", "last_active_timestamp", 
     "ticket_number", "is_recruiting_inquiry"
 ]
-    
-    # Prepare values, ensuring None for missing optional fields
-    values = [lead_dict.get(col) for col in columns]
 
+# Built once so sqlite3's statement cache always sees the same SQL text.
+# An upsert (not INSERT OR REPLACE) so the row is updated in place rather than deleted and re-inserted.
+_SAVE_LEAD_SQL = f'''
+    INSERT INTO leads ({', '.join(LEAD_COLUMNS)}) 
+    VALUES ({', '.join('?' for _ in LEAD_COLUMNS)})
+    ON CONFLICT(id) DO UPDATE SET
+        {', '.join(f'{col} = excluded.{col}' for col in LEAD_COLUMNS if col not in ('id', 'is_recruiting_inquiry'))},
+        is_recruiting_inquiry = leads.is_recruiting_inquiry OR excluded.is_recruiting_inquiry
+'''
+
+# Messages are append-only: a seq another writer already stored is never overwritten
+_INSERT_MESSAGE_SQL = '''
+    INSERT INTO messages (lead_id, seq, sender, text, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(lead_id, seq) DO NOTHING
+'''
+
+
+def _append_displaced_messages(conn: sqlite3.Connection, rows: List[tuple]) -> None:
+    """
+    Re-stores a message batch that found some of its seqs taken, after the newest stored message.
 
-    placeholders = ', '.join(['?' for _ in columns])
-    column_names_str = ', '.join(columns)
+    Happens when two writers hold the same lead (e.g. HTTP /chat while a
+    WebSocket session is open): both number new messages from their own view
+    of the history. Everything from the first displaced message on is moved,
+    so the batch keeps its order.
+    """
+    lead_id = rows[0][0]
+    first = 0
+    for first, row in enumerate(rows):
+        stored = conn.execute(
+            'SELECT sender, text, timestamp FROM messages WHERE lead_id = ? AND seq = ?', row[:2]
+        ).fetchone()
+        if tuple(stored) != row[2:]:
+            break
+    moved = rows[first:]
+    conn.executemany(
+        'DELETE FROM messages WHERE lead_id = ? AND seq = ? AND sender = ? AND text = ? AND timestamp = ?', moved
+    )
+    (last,) = conn.execute('SELECT MAX(seq) FROM messages WHERE lead_id = ?', (lead_id,)).fetchone()
+    conn.executemany(_INSERT_MESSAGE_SQL, [(lead_id, last + 1 + i) + row[2:] for i, row in enumerate(moved)])
+
+
+def _parse_legacy_history(raw: Optional[str]) -> List[Message]:
+    """Parses the old JSON conversation_history column (pre-messages-table rows)."""
+    conversation_history = []
+    if raw and raw != '[]':
+        try:
+            raw_history = json.loads(raw)
+            for msg_data in raw_history:
+                msg_data['timestamp'] = datetime.fromisoformat(msg_data['timestamp'])
+                conversation_history.append(Message(**msg_data))
+        except (json.JSONDecodeError, TypeError) as e:
+            print(f"Error parsing conversation_history: {e}")
+            conversation_history = []
+    return conversation_history
+
+
+def _row_to_message(row: sqlite3.Row) -> Message:
+    return Message(sender=row['sender'], text=row['text'], timestamp=datetime.fromisoformat(row['timestamp']))
+
+
+def _row_to_lead(row: sqlite3.Row, message_rows: List[sqlite3.Row]) -> Lead:
+    """Rebuilds a Lead from a `leads` row plus its `messages` rows (ordered by seq)."""
+    # CHANGED: Use column names directly instead of position mapping for safety
+    if message_rows:
+        conversation_history = [_row_to_message(m) for m in message_rows]
+        history_offset = message_rows[0]['seq']
+        persisted_seq = message_rows[-1]['seq'] + 1
+    else:
+        # Rows written before the messages table existed: the next save moves them over
+        conversation_history = _parse_legacy_history(row['conversation_history'])
+        history_offset = 0
+        persisted_seq = 0
+
+    # ADDED: Handle available_slots safely
+    available_slots = None
+    if row['available_slots']:
+        try:
+            available_slots = json.loads(row['available_slots'])
+        except (json.JSONDecodeError, TypeError):
+            available_slots = None
+
+    # ADDED: Handle last_active_timestamp safely
+    last_active_timestamp = datetime.now()
+    if row['last_active_timestamp']:
+        try:
+            last_active_timestamp = datetime.fromisoformat(row['last_active_timestamp'])
+        except (TypeError, ValueError):
+            last_active_timestamp = datetime.now()
+
+
+    # Reconstruct Lead object
+    lead = Lead(
+        id=row['id'],
+        phone_number=row['phone_number'],
+        full_name=row['full_name'],
+        age=row['age'],
+        state_of_residence=row['state_of_residence'],
+        general_health=row['general_health'],
+        health_conditions=row['health_conditions'], 
+        budget_range=row['budget_range'],
+        best_contact_time=row['best_contact_time'],
+        available_slots=available_slots,  # ADDED
+        selected_time_slot=row['selected_time_slot'],  # ADDED
+        qualification_stage=row['qualification_stage'] or 'initial_chat',  # ADDED: Default fallback
+        conversation_history=conversation_history,
+        last_active_timestamp=last_active_timestamp,  # CHANGED: Safe handling
+        ticket_number=row['ticket_number'],
+        is_recruiting_inquiry=bool(row['is_recruiting_inquiry'])
+    )
+    lead._history_offset = history_offset
+    lead._persisted_seq = persisted_seq
+    return lead
+
+
+def _get_lead_sync(lead_id: str, history_limit: Optional[int] = None) -> Optional[Lead]:
+    with _db() as conn:
+        row = conn.execute('SELECT * FROM leads WHERE id = ?', (lead_id,)).fetchone()
+        if not row:
+            return None
+        if history_limit:
+            message_rows = conn.execute(
+                'SELECT * FROM messages WHERE lead_id = ? ORDER BY seq DESC LIMIT ?',
+                (lead_id, history_limit)
+            ).fetchall()
+            message_rows.reverse()
+        else:
+            message_rows = conn.execute(
+                'SELECT * FROM messages WHERE lead_id = ? ORDER BY seq', (lead_id,)
+            ).fetchall()
+    return _row_to_lead(row, message_rows)
+
+
+# ───────────────  lead listing  ───────────────
+
+LEADS_PAGE_MAX = 500
+LeadCursor = Tuple[str, str]      # (last_active_timestamp as stored, id) of the last lead returned
+
+
+def _lead_filter_clauses(stage: Optional[str] = None, recruiting: Optional[bool] = None,
+                         active_since: Optional[datetime] = None,
+                         active_until: Optional[datetime] = None) -> Tuple[List[str], List]:
+    clauses, params = [], []
+    if stage is not None:
+        clauses.append('l.qualification_stage = ?')
+        params.append(stage)
+    if recruiting is not None:
+        clauses.append('l.is_recruiting_inquiry = ?')
+        params.append(1 if recruiting else 0)
+    # Timestamps are stored as naive local ISO strings, which sort chronologically
+    if active_since is not None:
+        clauses.append('l.last_active_timestamp >= ?')
+        params.append(_naive_local(active_since).isoformat())
+    if active_until is not None:
+        clauses.append('l.last_active_timestamp < ?')
+        params.append(_naive_local(active_until).isoformat())
+    return clauses, params
+
+
+def _naive_local(value: datetime) -> datetime:
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo else value
+
+
+def _fetch_leads_page_sync(after: Optional[LeadCursor] = None, limit: Optional[int] = None,
+                           **filters) -> Tuple[List[Lead], Optional[LeadCursor]]:
+    clauses, params = _lead_filter_clauses(**filters)
+    if after is not None:
+        clauses.append('(l.last_active_timestamp, l.id) < (?, ?)')
+        params.extend(after)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    with _db() as conn:
+        rows = conn.execute(f'''
+            SELECT l.* FROM leads l {where}
+            ORDER BY l.last_active_timestamp DESC, l.id DESC
+            LIMIT ?
+        ''', (*params, limit if limit is not None else -1)).fetchall()
+        messages_by_lead: Dict[str, List[sqlite3.Row]] = {}
+        # Bounded by LEADS_PAGE_MAX ids per query when paging
+        for start in range(0, len(rows), LEADS_PAGE_MAX):
+            ids = [row['id'] for row in rows[start:start + LEADS_PAGE_MAX]]
+            for m in conn.execute(
+                f"SELECT * FROM messages WHERE lead_id IN ({', '.join('?' for _ in ids)}) ORDER BY lead_id, seq",
+                ids
+            ):
+                messages_by_lead.setdefault(m['lead_id'], []).append(m)
+
+    leads = [_row_to_lead(row, messages_by_lead.get(row['id'], [])) for row in rows]
+    last = (rows[-1]['last_active_timestamp'], rows[-1]['id']) if rows else None
+    return leads, last
+
+
+async def get_leads_page(limit: Optional[int] = None, after: Optional[LeadCursor] = None,
+                         **filters) -> Tuple[List[Lead], Optional[LeadCursor]]:
+    """
+    Leads newest-first, by keyset on (last_active_timestamp, id).
 
+    Args:
+        limit (int, optional): Page size; None returns every matching lead
+        after (LeadCursor, optional): Cursor returned with the previous page
+        **filters: stage, recruiting, active_since, active_until
 
-    cursor.execute(f'''
-        INSERT OR REPLACE INTO leads ({column_names_str}) 
-        VALUES ({placeholders})
-    ''', values)
-    conn.commit()
-    conn.close()
-    print(f"Lead {lead.id} saved/updated in SQLite.")
+    Returns:
+        (leads, cursor): cursor is the key of the last lead, or None when the page is empty
+    """
+    return await run_db(_fetch_leads_page_sync, after, limit, **filters)
 
 
-async def get_lead_from_db(lead_id: str) -> Optional[Lead]:
-    """Retrieves a lead document from SQLite by ID."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row  # ADDED: Enable column name access for safety
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM leads WHERE id = ?', (lead_id,))
-    row = cursor.fetchone()
-    conn.close()
+async def iter_leads(batch_size: int = 200, after: Optional[LeadCursor] = None,
+                     **filters) -> AsyncIterator[Lead]:
+    """Yield matching leads newest-first (from `after`), holding one batch in memory at a time."""
+    while True:
+        leads, after = await get_leads_page(batch_size, after, **filters)
+        for lead in leads:
+            yield lead
+        if len(leads) < batch_size:
+            return
 
 
-    if row:
-        # CHANGED: Use column names directly instead of position mapping for safety
-        # Handle conversation_history safely
-        conversation_history = []
-        if row['conversation_history']:
-            try:
-                raw_history = json.loads(row['conversation_history'])
-                for msg_data in raw_history:
-                    msg_data['timestamp'] = datetime.fromisoformat(msg_data['timestamp'])
-                    conversation_history.append(Message(**msg_data))
-            except (json.JSONDecodeError, TypeError) as e:
-                print(f"Error parsing conversation_history: {e}")
-                conversation_history = []
-
-        # ADDED: Handle available_slots safely
-        available_slots = None
-        if row['available_slots']:
-            try:
-                available_slots = json.loads(row['available_slots'])
-            except (json.JSONDecodeError, TypeError):
-                available_slots = None
-
-        # ADDED: Handle last_active_timestamp safely
-        last_active_timestamp = datetime.now()
-        if row['last_active_timestamp']:
-            try:
-                last_active_timestamp = datetime.fromisoformat(row['last_active_timestamp'])
-            except (TypeError, ValueError):
-                last_active_timestamp = datetime.now()
-
-
-        # Reconstruct Lead object
-        lead = Lead(
-            id=row['id'],
-            phone_number=row['phone_number'],
-            full_name=row['full_name'],
-            age=row['age'],
-            state_of_residence=row['state_of_residence'],
-            general_health=row['general_health'],
-            health_conditions=row['health_conditions'], 
-            budget_range=row['budget_range'],
-            best_contact_time=row['best_contact_time'],
-            available_slots=available_slots,  # ADDED
-            selected_time_slot=row['selected_time_slot'],  # ADDED
-            qualification_stage=row['qualification_stage'] or 'initial_chat',  # ADDED: Default fallback
-            conversation_history=conversation_history,
-            last_active_timestamp=last_active_timestamp,  # CHANGED: Safe handling
-            ticket_number=row['ticket_number']
-        )
-        return lead
-    return None
+async def get_lead_from_db(lead_id: str, history_limit: Optional[int] = None) -> Optional[Lead]:
+    """
+    Retrieves a lead from SQLite by ID.
 
+    Args:
+        lead_id (str): The lead/session id
+        history_limit (int, optional): Load only the newest N messages instead of the full history
 
-async def get_all_leads_from_db() -> List[Lead]:
-    """Retrieves all lead documents from SQLite."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row  # ADDED: Enable column name access
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM leads')
-    rows = cursor.fetchall()
-    conn.close()
-
-
-    all_leads = []
-
-    for row in rows:
-        # CHANGED: Use row object directly instead of column mapping
-        # Handle conversation_history safely
-        conversation_history = []
-        if row['conversation_history']:
-            try:
-                raw_history = json.loads(row['conversation_history'])
-                for msg_data in raw_history:
-                    msg_data['timestamp'] = datetime.fromisoformat(msg_data['timestamp'])
-                    conversation_history.append(Message(**msg_data))
-            except (json.JSONDecodeError, TypeError):
-                conversation_history = []
-
-        # Handle available_slots safely
-        available_slots = None
-        if row['available_slots']:
-            try:
-                available_slots = json.loads(row['available_slots'])
-            except (json.JSONDecodeError, TypeError):
-                available_slots = None
-
-        # Handle last_active_timestamp safely
-        last_active_timestamp = datetime.now()
-        if row['last_active_timestamp']:
-            try:
-                last_active_timestamp = datetime.fromisoformat(row['last_active_timestamp'])
-            except (TypeError, ValueError):
-                last_active_timestamp = datetime.now()
-
-        lead = Lead(
-            id=row['id'],
-            phone_number=row['phone_number'],
-            full_name=row['full_name'],
-            age=row['age'],
-            state_of_residence=row['state_of_residence'],
-            general_health=row['general_health'],
-            health_conditions=row['health_conditions'],
-            budget_range=row['budget_range'],
-            best_contact_time=row['best_contact_time'],
-            available_slots=available_slots,  # ADDED
-            selected_time_slot=row['selected_time_slot'],  # ADDED
-            qualification_stage=row['qualification_stage'] or 'initial_chat',  # ADDED: Default fallback
-            conversation_history=conversation_history,
-            last_active_timestamp=last_active_timestamp,  # CHANGED: Safe handling
-            ticket_number=row['ticket_number']
-        )
-        all_leads.append(lead)
-    return all_leads
-
-
-async def get_recruiting_leads_from_db() -> List[Lead]:
-    """Retrieves all leads that have made recruiting inquiries."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row  # ADDED: Enable column name access
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM leads WHERE is_recruiting_inquiry = 1')
-    rows = cursor.fetchall()
-    conn.close()
-
-
-    recruiting_leads = []
-
-    for row in rows:
-        # CHANGED: Use row object directly instead of column mapping
-        # Handle conversation_history safely
-        conversation_history = []
-        if row['conversation_history']:
-            try:
-                raw_history = json.loads(row['conversation_history'])
-                for msg_data in raw_history:
-                    msg_data['timestamp'] = datetime.fromisoformat(msg_data['timestamp'])
-                    conversation_history.append(Message(**msg_data))
-            except (json.JSONDecodeError, TypeError):
-                conversation_history = []
-
-        # Handle available_slots safely
-        available_slots = None
-        if row['available_slots']:
-            try:
-                available_slots = json.loads(row['available_slots'])
-            except (json.JSONDecodeError, TypeError):
-                available_slots = None
-
-        # Handle last_active_timestamp safely
-        last_active_timestamp = datetime.now()
-        if row['last_active_timestamp']:
-            try:
-                last_active_timestamp = datetime.fromisoformat(row['last_active_timestamp'])
-            except (TypeError, ValueError):
-                last_active_timestamp = datetime.now()
-
-        lead = Lead(
-            id=row['id'],
-            phone_number=row['phone_number'],
-            full_name=row['full_name'],
-            age=row['age'],
-            state_of_residence=row['state_of_residence'],
-            general_health=row['general_health'],
-            health_conditions=row['health_conditions'],
-            budget_range=row['budget_range'],
-            best_contact_time=row['best_contact_time'],
-            available_slots=available_slots,  # ADDED
-            selected_time_slot=row['selected_time_slot'],  # ADDED
-            qualification_stage=row['qualification_stage'] or 'initial_chat',  # ADDED: Default fallback
-            conversation_history=conversation_history,
-            last_active_timestamp=last_active_timestamp,  # CHANGED: Safe handling
-            ticket_number=row['ticket_number']
-        )
-        recruiting_leads.append(lead)
-    return recruiting_leads
+    Returns:
+        Optional[Lead]: The lead, or None if it does not exist
+    """
+    return await run_db(_get_lead_sync, lead_id, history_limit)
 
 
 # Example usage function for testing
@@ -477,26 +584,25 @@ def test_recruiting_detection():
 
 #working code
 def store_uploaded_file_info(file_id: str, chunks_created: int):
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-
-    # Create table if not exists
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS uploaded_files (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            file_id TEXT,
-            chunks_created INTEGER
-        )
-    ''')
+    with _db() as conn:
+        cursor = conn.cursor()
+
+        # Create table if not exists
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS uploaded_files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_id TEXT,
+                chunks_created INTEGER
+            )
+        ''')
 
-    # Insert record
-    cursor.execute('''
-        INSERT INTO uploaded_files (file_id, chunks_created)
-        VALUES (?, ?)
-    ''', (file_id, chunks_created))
+        # Insert record
+        cursor.execute('''
+            INSERT INTO uploaded_files (file_id, chunks_created)
+            VALUES (?, ?)
+        ''', (file_id, chunks_created))
 
-    conn.commit()
-    conn.close()
+        conn.commit()
 
 
 # use this code insted of previous
@@ -504,88 +610,84 @@ def store_uploaded_file_info(file_id: str, chunks_created: int):
 
 def ensure_dataset_versions_table():
     """Create versioning table alongside existing uploaded_files table."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    with _db() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS dataset_versions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            version_label TEXT UNIQUE NOT NULL,
-            description TEXT,
-            total_records INTEGER,
-            upload_timestamp TEXT NOT NULL,
-            is_active BOOLEAN DEFAULT FALSE,
-            file_ids TEXT NOT NULL,
-            created_by TEXT
-        );
-    """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS dataset_versions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                version_label TEXT UNIQUE NOT NULL,
+                description TEXT,
+                total_records INTEGER,
+                upload_timestamp TEXT NOT NULL,
+                is_active BOOLEAN DEFAULT FALSE,
+                file_ids TEXT NOT NULL,
+                created_by TEXT
+            );
+        """)
     
-    conn.commit()
-    conn.close()
+        conn.commit()
 
 def store_versioned_dataset(version_label: str, description: str, file_ids: list, 
                            total_records: int, created_by: str = None):
     """Store a versioned dataset and make it active."""
     ensure_dataset_versions_table()
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    with _db() as conn:
+        cursor = conn.cursor()
     
-    try:
-        # Deactivate all previous versions
-        cursor.execute("UPDATE dataset_versions SET is_active = 0")
+        try:
+            # Deactivate all previous versions
+            cursor.execute("UPDATE dataset_versions SET is_active = 0")
         
-        # Insert new version as active
-        cursor.execute("""
-            INSERT INTO dataset_versions 
-            (version_label, description, total_records, upload_timestamp, is_active, file_ids, created_by)
-            VALUES (?, ?, ?, ?, 1, ?, ?)
-        """, (
-            version_label, 
-            description, 
-            total_records,
-            datetime.now().isoformat(),
-            json.dumps(file_ids),
-            created_by
-        ))
-        
-        # Insert into uploaded_files table (in the SAME connection)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS uploaded_files (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                file_id TEXT,
-                chunks_created INTEGER
-            )
-        ''')
+            # Insert new version as active
+            cursor.execute("""
+                INSERT INTO dataset_versions 
+                (version_label, description, total_records, upload_timestamp, is_active, file_ids, created_by)
+                VALUES (?, ?, ?, ?, 1, ?, ?)
+            """, (
+                version_label, 
+                description, 
+                total_records,
+                datetime.now().isoformat(),
+                json.dumps(file_ids),
+                created_by
+            ))
         
-        # Insert each file_id into uploaded_files
-        for file_id in file_ids:
+            # Insert into uploaded_files table (in the SAME connection)
             cursor.execute('''
-                INSERT INTO uploaded_files (file_id, chunks_created)
-                VALUES (?, ?)
-            ''', (file_id, len(file_ids)))
+                CREATE TABLE IF NOT EXISTS uploaded_files (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    file_id TEXT,
+                    chunks_created INTEGER
+                )
+            ''')
         
-        conn.commit()
+            # Insert each file_id into uploaded_files
+            for file_id in file_ids:
+                cursor.execute('''
+                    INSERT INTO uploaded_files (file_id, chunks_created)
+                    VALUES (?, ?)
+                ''', (file_id, len(file_ids)))
+        
+            conn.commit()
         
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+        except Exception as e:
+            conn.rollback()
+            raise e
 
 def get_active_dataset_version():
     """Get currently active dataset version."""
     ensure_dataset_versions_table()
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    with _db() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute("""
-        SELECT version_label, file_ids, total_records 
-        FROM dataset_versions 
-        WHERE is_active = 1 
-        LIMIT 1
-    """)
-    row = cursor.fetchone()
-    conn.close()
+        cursor.execute("""
+            SELECT version_label, file_ids, total_records 
+            FROM dataset_versions 
+            WHERE is_active = 1 
+            LIMIT 1
+        """)
+        row = cursor.fetchone()
     
     if row:
         return {
@@ -598,49 +700,142 @@ def get_active_dataset_version():
 def get_all_dataset_versions():
     """List all dataset versions."""
     ensure_dataset_versions_table()
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT version_label, description, total_records, upload_timestamp, 
-               is_active, created_by
-        FROM dataset_versions 
-        ORDER BY upload_timestamp DESC
-    """)
+    with _db() as conn:
+        cursor = conn.cursor()
     
-    versions = []
-    for row in cursor.fetchall():
-        versions.append({
-            "version": row[0],
-            "description": row[1] or "",
-            "total_records": row[2],
-            "upload_timestamp": row[3],
-            "is_active": bool(row[4]),
-            "created_by": row[5] or "Unknown"
-        })
+        cursor.execute("""
+            SELECT version_label, description, total_records, upload_timestamp, 
+                   is_active, created_by
+            FROM dataset_versions 
+            ORDER BY upload_timestamp DESC
+        """)
     
-    conn.close()
+        versions = []
+        for row in cursor.fetchall():
+            versions.append({
+                "version": row[0],
+                "description": row[1] or "",
+                "total_records": row[2],
+                "upload_timestamp": row[3],
+                "is_active": bool(row[4]),
+                "created_by": row[5] or "Unknown"
+            })
     return versions
 
 def set_active_dataset_version(version_label: str):
     """Switch active dataset version."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    with _db() as conn:
+        cursor = conn.cursor()
     
-    # Check if version exists
-    cursor.execute("SELECT id FROM dataset_versions WHERE version_label = ?", (version_label,))
-    if not cursor.fetchone():
-        conn.close()
-        return False
+        # Check if version exists
+        cursor.execute("SELECT id FROM dataset_versions WHERE version_label = ?", (version_label,))
+        if not cursor.fetchone():
+            return False
     
-    # Deactivate all, then activate the target
-    cursor.execute("UPDATE dataset_versions SET is_active = 0")
-    cursor.execute("UPDATE dataset_versions SET is_active = 1 WHERE version_label = ?", (version_label,))
+        # Deactivate all, then activate the target
+        cursor.execute("UPDATE dataset_versions SET is_active = 0")
+        cursor.execute("UPDATE dataset_versions SET is_active = 1 WHERE version_label = ?", (version_label,))
     
-    conn.commit()
-    conn.close()
+        conn.commit()
     return True
 
+
+# ───────────────  dataset ingestion jobs  ───────────────
+
+DATASET_JOB_COLUMNS = ["id", "version_label", "description", "status", "stage", "progress", "result",
+                       "error", "source_path", "worker_pid", "created_by", "created_at", "updated_at"]
+
+
+def ensure_dataset_jobs_table():
+    """Create the table tracking background dataset uploads."""
+    with _db() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS dataset_jobs (
+                id TEXT PRIMARY KEY,
+                version_label TEXT NOT NULL,
+                description TEXT,
+                status TEXT NOT NULL,         -- queued | running | completed | failed
+                stage TEXT,                   -- uploading | indexing | done
+                progress TEXT,                -- JSON counters
+                result TEXT,                  -- JSON summary once completed
+                error TEXT,
+                source_path TEXT,             -- spooled upload body, removed when the job ends
+                worker_pid INTEGER,           -- process running the job
+                created_by TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        conn.commit()
+
+
+def _row_to_dataset_job(row: sqlite3.Row) -> Dict:
+    job = dict(row)
+    for key in ("progress", "result"):
+        job[key] = json.loads(job[key]) if job[key] else None
+    return job
+
+
+def create_dataset_job(job_id: str, version_label: str, description: str, source_path: str,
+                       created_by: str = None) -> Optional[Dict]:
+    """
+    Insert a queued job owned by this process.
+
+    Returns None (and inserts nothing) when another queued or running job
+    already uses `version_label`.
+    """
+    now = datetime.now().isoformat()
+    with _db() as conn:
+        cur = conn.execute("""
+            INSERT INTO dataset_jobs
+            (id, version_label, description, status, source_path, worker_pid, created_by, created_at, updated_at)
+            SELECT ?, ?, ?, 'queued', ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM dataset_jobs WHERE version_label = ? AND status IN ('queued', 'running')
+            )
+        """, (job_id, version_label, description, source_path, os.getpid(), created_by, now, now, version_label))
+        conn.commit()
+        if cur.rowcount == 0:
+            return None
+    return get_dataset_job(job_id)
+
+
+def update_dataset_job(job_id: str, **fields) -> None:
+    """
+    Update some columns of a job.
+
+    Args:
+        job_id: Job to update.
+        **fields: Column values; `progress` and `result` are stored as JSON.
+    """
+    unknown = set(fields) - set(DATASET_JOB_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown dataset job columns: {sorted(unknown)}")
+    for key in ("progress", "result"):
+        if key in fields and fields[key] is not None:
+            fields[key] = json.dumps(fields[key])
+    fields["updated_at"] = datetime.now().isoformat()
+    assignments = ", ".join(f"{column} = ?" for column in fields)
+    with _db() as conn:
+        conn.execute(f"UPDATE dataset_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        conn.commit()
+
+
+def get_dataset_job(job_id: str) -> Optional[Dict]:
+    with _db() as conn:
+        row = conn.execute("SELECT * FROM dataset_jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row_to_dataset_job(row) if row else None
+
+
+def get_unfinished_dataset_jobs() -> List[Dict]:
+    """Jobs still queued or running, whichever process owns them."""
+    with _db() as conn:
+        rows = conn.execute(
+            "SELECT * FROM dataset_jobs WHERE status IN ('queued', 'running')"
+        ).fetchall()
+    return [_row_to_dataset_job(row) for row in rows]
+
+
 def _get_latest_file_id() -> Optional[str]:
     """Return file_id from active dataset version, fallback to legacy system."""
     
@@ -654,200 +849,228 @@ def _get_latest_file_id() -> Optional[str]:
         pass  # Fall back to legacy system
     
     # Fallback to your original logic
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT file_id FROM uploaded_files ORDER BY id DESC LIMIT 1")
-    row = cursor.fetchone()
-    conn.close()
+    with _db() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT file_id FROM uploaded_files ORDER BY id DESC LIMIT 1")
+        except sqlite3.OperationalError:      # nothing uploaded yet → table missing
+            return None
+        row = cursor.fetchone()
     return row[0] if row else None
 
 def ensure_admin_table() -> None:
     """
     Creates the admin table if it doesn’t exist.
     Columns:
-        id        INTEGER autoincrement primary-key
-        email     UNIQUE text
-        password  bcrypt-hashed text
+        id             INTEGER autoincrement primary-key
+        email          UNIQUE text
+        password       bcrypt-hashed text
+        token_version  bumped on password change; tokens carry it as `tv`
     """
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur  = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS admin (
-            id       INTEGER PRIMARY KEY AUTOINCREMENT,
-            email    TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL
-        );
-    """)
-    conn.commit()
-    conn.close()
+    with _db() as conn:
+        cur  = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS admin (
+                id       INTEGER PRIMARY KEY AUTOINCREMENT,
+                email    TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                token_version INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        cur.execute("PRAGMA table_info(admin)")
+        if 'token_version' not in [column[1] for column in cur.fetchall()]:
+            print("Adding token_version column to admin table...")
+            cur.execute("ALTER TABLE admin ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0")
+        conn.commit()
 
 def get_admin_by_email(email: str) -> Optional[dict]:
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur  = conn.cursor()
-    cur.execute("SELECT id, email, password FROM admin WHERE email = ?", (email.lower(),))
-    row = cur.fetchone()
-    conn.close()
+    with _db() as conn:
+        cur  = conn.cursor()
+        cur.execute("SELECT id, email, password, token_version FROM admin WHERE email = ?", (email.lower(),))
+        row = cur.fetchone()
     if row:
-        return {"id": row[0], "email": row[1], "password": row[2]}
+        return {"id": row[0], "email": row[1], "password": row[2], "token_version": row[3]}
     return None
 
 
 def create_admin(email: str, hashed_pw: str) -> dict:
     ensure_admin_table()
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur  = conn.cursor()
-    cur.execute(
-        "INSERT INTO admin (email, password) VALUES (?, ?)",
-        (email.lower(), hashed_pw)
-    )
-    conn.commit()
-    admin_id = cur.lastrowid
-    conn.close()
-    return {"id": admin_id, "email": email.lower()}
+    with _db() as conn:
+        cur  = conn.cursor()
+        cur.execute(
+            "INSERT INTO admin (email, password) VALUES (?, ?)",
+            (email.lower(), hashed_pw)
+        )
+        conn.commit()
+        admin_id = cur.lastrowid
+    return {"id": admin_id, "email": email.lower(), "token_version": 0}
 
 
 def update_admin_password(admin_id: int, hashed_pw: str) -> None:
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur  = conn.cursor()
-    cur.execute(
-        "UPDATE admin SET password = ? WHERE id = ?",
-        (hashed_pw, admin_id)
-    )
-    conn.commit()
-    conn.close()
+    """Store a new password hash and revoke every token issued before it."""
+    with _db() as conn:
+        cur  = conn.cursor()
+        cur.execute(
+            "UPDATE admin SET password = ?, token_version = token_version + 1 WHERE id = ?",
+            (hashed_pw, admin_id)
+        )
+        conn.commit()
+
+# ───────────────  widget config generation  ───────────────
+
+def ensure_config_version_table():
+    """Create the single-row counter bumped by every widget config write."""
+    with _db() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS config_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                generation INTEGER NOT NULL
+            )
+        """)
+        conn.execute("INSERT OR IGNORE INTO config_version (id, generation) VALUES (1, 0)")
+        conn.commit()
+
+
+def get_config_generation() -> int:
+    """Current widget config generation (welcome message, quick links, theme)."""
+    with _db() as conn:
+        row = conn.execute("SELECT generation FROM config_version WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+
+def _bump_config_generation(cur) -> None:
+    # Same transaction as the config write, so other workers never see one without the other
+    cur.execute("UPDATE config_version SET generation = generation + 1 WHERE id = 1")
+
 
 #sahil
 def ensure_welcome_table():
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS welcome_message (
-            id INTEGER PRIMARY KEY CHECK (id = 1),
-            message TEXT NOT NULL
-        )
-    """)
-    cur.execute("INSERT OR IGNORE INTO welcome_message (id, message) VALUES (1, 'Welcome to the Admin Panel')")
-    conn.commit()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS welcome_message (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                message TEXT NOT NULL
+            )
+        """)
+        cur.execute("INSERT OR IGNORE INTO welcome_message (id, message) VALUES (1, 'Welcome to the Admin Panel')")
+        conn.commit()
  
 def get_welcome_message() -> str:
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur = conn.cursor()
-    cur.execute("SELECT message FROM welcome_message WHERE id = 1")
-    row = cur.fetchone()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT message FROM welcome_message WHERE id = 1")
+        row = cur.fetchone()
     return row[0] if row else ""
  
 def update_welcome_message(new_message: str) -> None:
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur = conn.cursor()
-    cur.execute("UPDATE welcome_message SET message = ? WHERE id = 1", (new_message,))
-    conn.commit()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE welcome_message SET message = ? WHERE id = 1", (new_message,))
+        _bump_config_generation(cur)
+        conn.commit()
  
  
 def ensure_quicklink_table():
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS quick_links (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT NOT NULL,
-            active INTEGER DEFAULT 0
-        )
-    """)
-    conn.commit()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS quick_links (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                description TEXT NOT NULL,
+                active INTEGER DEFAULT 0
+            )
+        """)
+        conn.commit()
  
  
 def get_active_quicklinks() -> list[dict]:
     ensure_quicklink_table()
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur = conn.cursor()
-    cur.execute("SELECT id, title, description FROM quick_links WHERE active = 1")
-    rows = cur.fetchall()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, title, description FROM quick_links WHERE active = 1")
+        rows = cur.fetchall()
     return [{"id": row[0], "title": row[1], "description": row[2]} for row in rows]
  
  
 def create_quicklink(title: str, description: str) -> dict:
     ensure_quicklink_table()
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO quick_links (title, description, active) VALUES (?, ?, 1)",
-        (title, description)
-    )
-    conn.commit()
-    link_id = cur.lastrowid
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO quick_links (title, description, active) VALUES (?, ?, 1)",
+            (title, description)
+        )
+        link_id = cur.lastrowid
+        _bump_config_generation(cur)
+        conn.commit()
     return {"id": link_id, "title": title, "description": description}
  
 def update_quicklink(link_id: int, title: str, description: str) -> bool:
     ensure_quicklink_table()
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE quick_links SET title = ?, description = ? WHERE id = ?",
-        (title, description, link_id)
-    )
-    conn.commit()
-    success = cur.rowcount > 0
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE quick_links SET title = ?, description = ? WHERE id = ?",
+            (title, description, link_id)
+        )
+        success = cur.rowcount > 0
+        if success:
+            _bump_config_generation(cur)
+        conn.commit()
     return success
  
 def delete_quicklink(link_id: int) -> bool:
     ensure_quicklink_table()
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM quick_links WHERE id = ?", (link_id,))
-    conn.commit()
-    success = cur.rowcount > 0
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM quick_links WHERE id = ?", (link_id,))
+        success = cur.rowcount > 0
+        if success:
+            _bump_config_generation(cur)
+        conn.commit()
     return success
 
  
 def ensure_theme_table():
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS theme_config (
-            id INTEGER PRIMARY KEY CHECK (id = 1),
-            primary_color TEXT,
-            background_color TEXT,
-            text_color TEXT,
-            border_radius INTEGER,
-            widget_position TEXT,
-            avatar_image_url TEXT,
-            welcome_delay INTEGER,
-            company_name TEXT,
-            logo TEXT,
-            body_font_family TEXT,
-            body_font_size INTEGER,
-            body_font_weight TEXT,
-            heading_font_family TEXT,
-            heading_font_weight TEXT
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS theme_config (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                primary_color TEXT,
+                background_color TEXT,
+                text_color TEXT,
+                border_radius INTEGER,
+                widget_position TEXT,
+                avatar_image_url TEXT,
+                welcome_delay INTEGER,
+                company_name TEXT,
+                logo TEXT,
+                body_font_family TEXT,
+                body_font_size INTEGER,
+                body_font_weight TEXT,
+                heading_font_family TEXT,
+                heading_font_weight TEXT
                 
-        )
-    """)
-    conn.commit()
-    conn.close()
+            )
+        """)
+        conn.commit()
  
 
 
 def get_theme_config() -> dict:
     ensure_theme_table()
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT primary_color, background_color, text_color, border_radius,
-               widget_position, avatar_image_url, welcome_delay,company_name,logo,body_font_family, body_font_size, body_font_weight,
-               heading_font_family, heading_font_weight
-        FROM theme_config WHERE id = 1
-    """)
-    row = cur.fetchone()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT primary_color, background_color, text_color, border_radius,
+                   widget_position, avatar_image_url, welcome_delay,company_name,logo,body_font_family, body_font_size, body_font_weight,
+                   heading_font_family, heading_font_weight
+            FROM theme_config WHERE id = 1
+        """)
+        row = cur.fetchone()
     if row:
         return {
             "primary_color": row[0],
@@ -870,72 +1093,53 @@ def get_theme_config() -> dict:
  
 def update_theme_config(data: dict) -> None:
     ensure_theme_table()
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur = conn.cursor()
-
-    # Always using id=1 for single config row
-    cur.execute("""
-        INSERT INTO theme_config (
-            id, primary_color, background_color, text_color, border_radius,
-            widget_position, avatar_image_url, welcome_delay, company_name, logo,body_font_family, body_font_size, body_font_weight,
-            heading_font_family, heading_font_weight
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(id) DO UPDATE SET
-            primary_color = COALESCE(excluded.primary_color, primary_color),
-            background_color = COALESCE(excluded.background_color, background_color),
-            text_color = COALESCE(excluded.text_color, text_color),
-            border_radius = COALESCE(excluded.border_radius, border_radius),
-            widget_position = COALESCE(excluded.widget_position, widget_position),
-            avatar_image_url = COALESCE(excluded.avatar_image_url, avatar_image_url),
-            welcome_delay = COALESCE(excluded.welcome_delay, welcome_delay),
-            company_name = COALESCE(excluded.company_name, company_name),
-            logo = COALESCE(excluded.logo, logo),
-            body_font_family = COALESCE(excluded.body_font_family, body_font_family),
-            body_font_size = COALESCE(excluded.body_font_size, body_font_size),
-            body_font_weight = COALESCE(excluded.body_font_weight, body_font_weight),
-            heading_font_family = COALESCE(excluded.heading_font_family, heading_font_family),
-            heading_font_weight = COALESCE(excluded.heading_font_weight, heading_font_weight)
-    """, (
-        1,  # ID fixed for single row config
-        data.get("primary_color"),
-        data.get("background_color"),
-        data.get("text_color"),
-        data.get("border_radius"),
-        data.get("widget_position"),
-        data.get("avatar_image_url"),
-        data.get("welcome_delay"),
-        data.get("company_name"),
-        data.get("logo"),
-        data.get("body_font_family"),
-        data.get("body_font_size"),
-        data.get("body_font_weight"),
-        data.get("heading_font_family"),
-        data.get("heading_font_weight")
-    ))
-
-    conn.commit()
-    conn.close()
-
-
-
-async def get_all_conversations_from_db() -> List[Dict[str, List[Message]]]:
-    """
-    Retrieves only the conversations from all leads.
-    
-    Returns:
-        List[Dict[str, List[Message]]]: A list of dictionaries with lead ID and conversation history.
-    """
-    leads = await get_all_leads_from_db()
-    conversations = []
+    with _db() as conn:
+        cur = conn.cursor()
+
+        # Always using id=1 for single config row
+        cur.execute("""
+            INSERT INTO theme_config (
+                id, primary_color, background_color, text_color, border_radius,
+                widget_position, avatar_image_url, welcome_delay, company_name, logo,body_font_family, body_font_size, body_font_weight,
+                heading_font_family, heading_font_weight
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                primary_color = COALESCE(excluded.primary_color, primary_color),
+                background_color = COALESCE(excluded.background_color, background_color),
+                text_color = COALESCE(excluded.text_color, text_color),
+                border_radius = COALESCE(excluded.border_radius, border_radius),
+                widget_position = COALESCE(excluded.widget_position, widget_position),
+                avatar_image_url = COALESCE(excluded.avatar_image_url, avatar_image_url),
+                welcome_delay = COALESCE(excluded.welcome_delay, welcome_delay),
+                company_name = COALESCE(excluded.company_name, company_name),
+                logo = COALESCE(excluded.logo, logo),
+                body_font_family = COALESCE(excluded.body_font_family, body_font_family),
+                body_font_size = COALESCE(excluded.body_font_size, body_font_size),
+                body_font_weight = COALESCE(excluded.body_font_weight, body_font_weight),
+                heading_font_family = COALESCE(excluded.heading_font_family, heading_font_family),
+                heading_font_weight = COALESCE(excluded.heading_font_weight, heading_font_weight)
+        """, (
+            1,  # ID fixed for single row config
+            data.get("primary_color"),
+            data.get("background_color"),
+            data.get("text_color"),
+            data.get("border_radius"),
+            data.get("widget_position"),
+            data.get("avatar_image_url"),
+            data.get("welcome_delay"),
+            data.get("company_name"),
+            data.get("logo"),
+            data.get("body_font_family"),
+            data.get("body_font_size"),
+            data.get("body_font_weight"),
+            data.get("heading_font_family"),
+            data.get("heading_font_weight")
+        ))
+        _bump_config_generation(cur)
 
-    for lead in leads:
-        conversations.append({
-            "id": lead.id,
-            "conversation_history": lead.conversation_history
-        })
+        conn.commit()
 
-    return conversations
 
 
 #Appointment Booking
@@ -944,27 +1148,25 @@ def ensure_appointment_table():
     Ensures the appointment table exists with a foreign key referencing leads.id,
     and includes columns for name, age, state, booking_date, status (boolean), created_at.
     """
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur = conn.cursor()
-    cur.execute("""
-        PRAGMA foreign_keys = ON;
-    """)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS appointment (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            lead_id TEXT NOT NULL,
-            name TEXT NOT NULL,
-            age INTEGER,
-            state TEXT,
-            booking_date TEXT NOT NULL,         -- ISO date string
-            ticket_no TEXT NOT NULL,
-            status BOOLEAN NOT NULL DEFAULT FALSE,
-            created_at TEXT NOT NULL,
-            FOREIGN KEY (lead_id) REFERENCES leads(id) ON DELETE CASCADE
-        );
-    """)
-    conn.commit()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        # No `PRAGMA foreign_keys = ON` here: pooled connections are reused, and the
+        # pragma would make INSERT OR REPLACE on leads cascade-delete appointments.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS appointment (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                lead_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                age INTEGER,
+                state TEXT,
+                booking_date TEXT NOT NULL,         -- ISO date string
+                ticket_no TEXT NOT NULL,
+                status BOOLEAN NOT NULL DEFAULT FALSE,
+                created_at TEXT NOT NULL,
+                FOREIGN KEY (lead_id) REFERENCES leads(id) ON DELETE CASCADE
+            );
+        """)
+        conn.commit()
 
 
 def save_appointment_to_db_from_lead(lead) -> int:
@@ -980,49 +1182,44 @@ def save_appointment_to_db_from_lead(lead) -> int:
     if not getattr(lead, "full_name", None):
         raise ValueError("Lead does not have full_name")
  
-    conn = sqlite3.connect(DATABASE_FILE)
-    cur = conn.cursor()
-    created_at = datetime.now().isoformat()
+    with _db() as conn:
+        cur = conn.cursor()
+        created_at = datetime.now().isoformat()
  
-    cur.execute("""
-        INSERT INTO appointment (lead_id, name, age, state, booking_date, status, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (
-        lead.id,
-        getattr(lead, "full_name", None),
-        getattr(lead, "age", None),
-        getattr(lead, "state_of_residence", None),
-        getattr(lead, "selected_time_slot", None),
-        True,  # confirmed
-        created_at
-    ))
-    conn.commit()
-    appt_id = cur.lastrowid
-    conn.close()
+        cur.execute("""
+            INSERT INTO appointment (lead_id, name, age, state, booking_date, status, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (
+            lead.id,
+            getattr(lead, "full_name", None),
+            getattr(lead, "age", None),
+            getattr(lead, "state_of_residence", None),
+            getattr(lead, "selected_time_slot", None),
+            True,  # confirmed
+            created_at
+        ))
+        conn.commit()
+        appt_id = cur.lastrowid
     return appt_id
  
  
 def get_appointments_from_db(lead_id: Optional[str] = None) -> List[dict]:
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    if lead_id:
-        cur.execute("SELECT * FROM appointment WHERE lead_id = ? ORDER BY created_at DESC", (lead_id,))
-    else:
-        cur.execute("SELECT * FROM appointment ORDER BY created_at DESC")
-    rows = cur.fetchall()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        if lead_id:
+            cur.execute("SELECT * FROM appointment WHERE lead_id = ? ORDER BY created_at DESC", (lead_id,))
+        else:
+            cur.execute("SELECT * FROM appointment ORDER BY created_at DESC")
+        rows = cur.fetchall()
     return [dict(r) for r in rows]
  
  
 
 def get_appointment_by_id(appt_id: int) -> Optional[dict]:
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM appointment WHERE id = ?", (appt_id,))
-    row = cur.fetchone()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM appointment WHERE id = ?", (appt_id,))
+        row = cur.fetchone()
     return dict(row) if row else None
 
 
@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+
+# The app keeps leads.db, media/ and the embedding store relative to the working
+# directory and reads its settings at import time, so isolate both before importing it.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="chatbot-tests-")
+sys.path.insert(0, ROOT)
+os.chdir(WORKDIR)
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ["EMBED_STORE_DIR"] = os.path.join(WORKDIR, "embeddings")
+
+import main                      # noqa: E402
+import file_embaded as fe        # noqa: E402
+import sqlite_utils              # noqa: E402
+
+EMBED_DIM = 8
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    """Empty lead/dataset tables and no FAQ index or query-cache state."""
+    sqlite_utils.initialize_sqlite_db()
+    sqlite_utils.ensure_dataset_versions_table()
+    main.on_startup()
+    with sqlite_utils._db() as conn:
+        for table in ("leads", "messages", "dataset_versions", "dataset_jobs"):
+            conn.execute(f"DELETE FROM {table}")
+        conn.commit()
+    fe._registry._indexes.clear()
+    fe._active_builds.clear()
+    fe._hot_keys.clear()
+    fe._build_failed_at.clear()
+    fe._query_cache._entries.clear()
+    monkeypatch.setattr(fe._query_cache, "persist", False)
+    monkeypatch.setattr(fe, "_active_index", None)
+    monkeypatch.setattr(fe, "_last_build_error", None)
+    monkeypatch.setattr(fe, "_index_builds", fe.SingleFlight())
+
+
+@pytest.fixture
+def embed_calls(monkeypatch):
+    """
+    Replace embedding_provider.embed; returns the list of texts batches it was called with.
+
+    FAQ prompts ("q<n>") embed along the first axis and anything else along the
+    last, so user messages never clear the similarity threshold.
+    """
+    calls = []
+
+    async def embed(texts):
+        calls.append(list(texts))
+        vectors = np.zeros((len(texts), EMBED_DIM), dtype=np.float32)
+        for row, text in enumerate(texts):
+            vectors[row, 0 if text.startswith("q") else -1] = 1.0
+        return vectors
+
+    monkeypatch.setattr(fe.embedding_provider, "embed", embed)
+    return calls
+
+
+@pytest.fixture
+def llm_replies(monkeypatch):
+    """Replace the LLM fallback; returns the histories it was asked to answer."""
+    histories = []
+
+    async def fake_openai_response(chat_history, system_prompt):
+        histories.append(chat_history)
+        return "LLM reply"
+
+    monkeypatch.setattr(main, "get_openai_response", fake_openai_response)
+    return histories
@@ -0,0 +1,19 @@
+import asyncio
+
+import main
+from schemas import ChatRequest
+
+
+def test_failed_turn_is_logged_when_nobody_reads_the_stream(monkeypatch, capsys):
+    async def failing_turn(chat_request, llm_responder=None, session=None):
+        raise RuntimeError("llm down")
+
+    monkeypatch.setattr(main, "run_chat_turn", failing_turn)
+
+    async def disconnect_before_reading():
+        await main.chat_with_bot_stream(ChatRequest(user_id="u1", message="hi"))
+        await asyncio.sleep(0)           # let the turn fail; the response body is never iterated
+
+    asyncio.run(disconnect_before_reading())
+
+    assert "Streamed chat turn for u1 failed: llm down" in capsys.readouterr().out
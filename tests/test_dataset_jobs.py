@@ -0,0 +1,68 @@
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import dataset_jobs
+from dataset_upload import DatasetFormatError
+import sqlite_utils
+
+
+class FakeFiles:
+    def __init__(self):
+        self.created = []
+        self.deleted = []
+
+    async def create(self, file, purpose):
+        file_id = f"file-{len(self.created)}"
+        self.created.append(file_id)
+        return SimpleNamespace(id=file_id)
+
+    async def delete(self, file_id):
+        self.deleted.append(file_id)
+
+
+def test_failed_indexing_deletes_uploaded_chunks(monkeypatch, tmp_path):
+    async def failing_prebuild(file_ids):
+        raise RuntimeError("embedding service down")
+
+    async def skip_chunk_index(file_id, raw, register=True):
+        return None
+
+    monkeypatch.setattr(dataset_jobs, "prebuild_dataset_index", failing_prebuild)
+    monkeypatch.setattr(dataset_jobs, "index_dataset_bytes", skip_chunk_index)
+    source = tmp_path / "upload.json"
+    source.write_text(json.dumps([{"user_input": f"q{i}", "bot_response": "a"} for i in range(5)]))
+    sqlite_utils.create_dataset_job("job1", "v1", "", str(source))
+    client = SimpleNamespace(files=FakeFiles())
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(dataset_jobs.ingest_dataset("job1", client, str(source), "v1", "", "admin", chunk_size=2))
+
+    assert len(client.files.created) == 3
+    assert sorted(client.files.deleted) == sorted(client.files.created)
+    assert not os.path.exists(source)
+    assert sqlite_utils.get_active_dataset_version() is None
+
+
+def test_label_of_an_unfinished_job_cannot_be_queued_again():
+    assert sqlite_utils.create_dataset_job("job-a", "v2", "", "a.json") is not None
+    assert sqlite_utils.create_dataset_job("job-b", "v2", "", "b.json") is None
+
+    sqlite_utils.update_dataset_job("job-a", status="failed")
+    assert sqlite_utils.create_dataset_job("job-c", "v2", "", "c.json") is not None
+
+
+def test_malformed_record_fails_the_upload(tmp_path):
+    records = [{"user_input": "q0", "bot_response": "a"}] * 3 + [{"user_input": "q3"}]
+    source = tmp_path / "upload.json"
+    source.write_text(json.dumps(records))
+    sqlite_utils.create_dataset_job("job1", "v1", "", str(source))
+    client = SimpleNamespace(files=FakeFiles())
+
+    with pytest.raises(DatasetFormatError, match="Record 3"):
+        asyncio.run(dataset_jobs.ingest_dataset("job1", client, str(source), "v1", "", "admin", chunk_size=2))
+
+    assert sorted(client.files.deleted) == sorted(client.files.created)
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+import main
+import file_embaded as fe
+from conftest import EMBED_DIM
+
+
+def _serve_index(monkeypatch, rows: int = 20):
+    vectors = np.zeros((rows, EMBED_DIM), dtype=np.float32)
+    vectors[:, 0] = 1.0
+    index = fe.EmbeddingIndex("test", vectors, [f"a{i}" for i in range(rows)], [f"q{i}" for i in range(rows)])
+
+    async def get_active_index(wait: bool = False):
+        return index
+
+    monkeypatch.setattr(fe, "get_active_index", get_active_index)
+    return index
+
+
+def test_faq_miss_in_initial_chat_embeds_the_message_once(monkeypatch, embed_calls, llm_replies):
+    _serve_index(monkeypatch)
+    client = TestClient(main.app)
+    client.post("/chat", json={"user_id": "u1", "message": "hi"})     # creates the lead, no lookup
+    embed_calls.clear()
+
+    response = client.post("/chat", json={"user_id": "u1", "message": "how do premiums work"})
+
+    assert response.status_code == 200
+    assert response.json()["lead_status"] == "initial_chat"
+    assert response.json()["bot_message"] == "LLM reply"
+    assert embed_calls == [["how do premiums work"]]
+    assert len(llm_replies) == 1
+
+
+def test_faq_hit_answers_without_the_llm(monkeypatch, embed_calls, llm_replies):
+    index = _serve_index(monkeypatch)
+    index.lexical                     # built during activation when served for real
+    client = TestClient(main.app)
+    client.post("/chat", json={"user_id": "u2", "message": "hi"})
+
+    response = client.post("/chat", json={"user_id": "u2", "message": "q3"})
+
+    assert response.json()["bot_message"] == "a3"
+    assert llm_replies == []
+
+
+def test_lexical_index_is_built_lazily():
+    vectors = np.eye(4, EMBED_DIM, dtype=np.float32)
+    index = fe.EmbeddingIndex("lazy", vectors, ["a"] * 4, ["q0", "q1", "q2", "q3"])
+    reordered = index.build_ivf()
+
+    assert not index.lexical_ready and not reordered.lexical_ready
+    assert index.lexical.lookup_exact("q2") == 2
+    assert index.lexical_ready
+
+
+def test_persisted_query_cache_writes_in_the_background(monkeypatch):
+    release, stored = threading.Event(), []
+
+    def slow_db_put(key, vector):
+        release.wait(5)
+        stored.append(key)
+
+    cache = fe.QueryEmbeddingCache(10, persist=True)
+    monkeypatch.setattr(cache, "_db_put", slow_db_put)
+
+    async def miss():
+        await asyncio.wait_for(cache.put("hello", np.ones(EMBED_DIM, dtype=np.float32)), 1)
+        assert stored == [] and len(cache._writes) == 1
+        release.set()
+        await asyncio.gather(*cache._writes)
+
+    asyncio.run(miss())
+    assert stored == ["hello"] and not cache._writes
@@ -0,0 +1,89 @@
+import asyncio
+import json
+from collections import Counter
+
+import httpx
+
+import main
+import file_embaded as fe
+import sqlite_utils
+
+
+class CountingSingleFlight(fe.SingleFlight):
+    def __init__(self):
+        super().__init__()
+        self.started_by_key = Counter()
+
+    async def do(self, key, fn):
+        if key not in self:
+            self.started_by_key[key] += 1
+        return await super().do(key, fn)
+
+
+def test_concurrent_chat_turns_share_one_index_build(monkeypatch, embed_calls, llm_replies):
+    downloads = []
+
+    async def download(file_id):
+        downloads.append(file_id)
+        await asyncio.sleep(0.2)              # keep the build in flight while turns pile up
+        lines = (json.dumps({"prompt": f"q{i}", "completion": f" a{i}"}) for i in range(50))
+        return "\n".join(lines).encode()
+
+    builds = CountingSingleFlight()
+    monkeypatch.setattr(fe, "_download_file_bytes", download)
+    monkeypatch.setattr(fe, "_index_builds", builds)
+    sqlite_utils.store_versioned_dataset("v1", "", ["fa"], 50)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await asyncio.gather(*(client.post("/chat", json={"user_id": f"u{i}", "message": "hi"})
+                                   for i in range(100)))
+            responses = await asyncio.gather(*(client.post("/chat", json={"user_id": f"u{i}", "message": "q1"})
+                                               for i in range(100)))
+        return responses, await fe.get_active_index(wait=True)
+
+    responses, index = asyncio.run(scenario())
+
+    assert {r.status_code for r in responses} == {200}
+    assert index is not None and len(index) == 50
+    assert downloads == ["fa"]
+    # A single-file version is served by its file index, so that is the only build
+    assert builds.started_by_key == {"file:fa": 1}
+    assert builds.stats()["started"] == 1
+    prompt_batches = [batch for batch in embed_calls if batch[0].startswith("q") and len(batch) > 1]
+    assert len(prompt_batches) == 1
+
+
+def test_failed_build_is_not_retried_by_every_turn(monkeypatch, embed_calls):
+    downloads = []
+
+    async def missing_file(file_id):
+        downloads.append(file_id)
+        raise RuntimeError("No such file")
+
+    monkeypatch.setattr(fe, "_download_file_bytes", missing_file)
+    sqlite_utils.store_versioned_dataset("v1", "", ["gone"], 1)
+
+    async def scenario():
+        assert await fe.get_active_index() is None       # starts the build in the background
+        await asyncio.sleep(0.05)
+        for _ in range(10):
+            assert await fe.get_active_index() is None
+        return (await fe.get_index_status())["retry_in_s"]
+
+    retry_in = asyncio.run(scenario())
+
+    assert downloads == ["gone"]
+    assert retry_in > 0
+
+
+def test_registered_index_is_served_on_the_first_turn(monkeypatch, embed_calls):
+    import numpy as np
+
+    index = fe.EmbeddingIndex("fb", np.eye(3, 8, dtype=np.float32), ["a0", "a1", "a2"], ["q0", "q1", "q2"])
+    fe._registry.put(index)
+    sqlite_utils.store_versioned_dataset("v1", "", ["fb"], 3)
+
+    assert asyncio.run(fe.get_active_index()) is index
+    assert fe._active_index is index
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+import main
+import sqlite_utils
+from schemas import Lead, Message
+
+
+def _seed(count: int):
+    start = datetime(2026, 1, 1)
+    for i in range(count):
+        sqlite_utils._save_lead_sync(Lead(
+            id=f"L{i:03d}",
+            qualification_stage="ask_name" if i % 3 == 0 else "initial_chat",
+            last_active_timestamp=start + timedelta(minutes=i // 2),       # pairs share a timestamp
+            conversation_history=[Message(sender="user", text=f"hi {i}")],
+            is_recruiting_inquiry=i % 10 == 0,
+        ))
+
+
+def test_keyset_pages_cover_every_lead_once():
+    _seed(45)
+    client = TestClient(main.app)
+    seen, cursor = [], None
+    while True:
+        response = client.get("/admin/all_leads", params={"limit": 10, **({"cursor": cursor} if cursor else {})})
+        seen += [lead["id"] for lead in response.json()]
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+
+    assert len(seen) == 45 and len(set(seen)) == 45
+    assert seen[0] == "L044"
+
+
+def test_filters_and_ndjson_stream():
+    _seed(30)
+    client = TestClient(main.app)
+
+    assert len(client.get("/admin/recruiting_leads").json()) == 3
+    assert len(client.get("/admin/all_leads", params={"stage": "ask_name"}).json()) == 10
+    response = client.get("/conversations", params={"format": "ndjson", "recruiting": "true"})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert len(response.text.strip().splitlines()) == 3
+
+
+def test_single_conversation_is_looked_up_by_id():
+    _seed(3)
+    client = TestClient(main.app)
+
+    assert client.get("/conversations/L001").json()["conversation_history"][0]["text"] == "hi 1"
+    assert client.get("/conversations/missing").status_code == 404
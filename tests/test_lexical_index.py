@@ -0,0 +1,23 @@
+from lexical_index import LexicalIndex
+
+
+def test_wordless_messages_never_match_exactly():
+    index = LexicalIndex(["👍", "how much does a policy cost"])
+
+    assert "" not in index.exact
+    for message in ("👍", "?", "..."):
+        assert index.lookup_exact(message) is None
+        assert index.search(message) == []
+
+
+def test_duplicate_prompt_is_not_its_own_runner_up():
+    index = LexicalIndex([
+        "how much does a policy cost",
+        "what does final expense cover",
+        "how much does a policy cost",
+    ])
+
+    hits = index.search("how much does a policy cost")
+
+    assert [row for row, _ in hits] == [0, 1]
+    assert hits[0][1] - hits[1][1] > 0.5
@@ -0,0 +1,33 @@
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from auths import AttemptThrottle
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "ip_throttle", AttemptThrottle(3))
+    monkeypatch.setattr(main, "email_throttle", AttemptThrottle(5))
+    return TestClient(main.app)
+
+
+def test_successful_logins_do_not_use_the_ip_budget(client):
+    email = f"{uuid.uuid4().hex}@example.com"
+    assert client.post("/register", data={"email": email, "password": "pw"}).status_code == 200
+
+    for _ in range(5):
+        assert client.post("/login", data={"email": email, "password": "pw"}).status_code == 200
+    assert main.ip_throttle.metrics()["tracked_keys"] == 0
+
+
+def test_failed_logins_throttle_the_ip(client):
+    for _ in range(3):
+        email = f"{uuid.uuid4().hex}@example.com"     # a new email each time: only the IP limit applies
+        assert client.post("/login", data={"email": email, "password": "x"}).status_code == 401
+
+    response = client.post("/login", data={"email": "other@example.com", "password": "x"})
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) > 0
@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta
+
+import sqlite_utils
+from schemas import Lead, Message
+
+START = datetime(2026, 1, 1)
+
+
+def _say(lead: Lead, *texts: str) -> None:
+    for text in texts:
+        lead.conversation_history.append(
+            Message(sender="user", text=text, timestamp=START + timedelta(seconds=len(lead.conversation_history))))
+
+
+def test_stale_writer_appends_instead_of_overwriting():
+    lead = Lead(id="L1", qualification_stage="initial_chat")
+    _say(lead, "hi", "hello")
+    sqlite_utils._save_lead_sync(lead)
+
+    # Two writers load the same lead; the second saves after the first
+    http_copy = sqlite_utils._get_lead_sync("L1")
+    ws_copy = sqlite_utils._get_lead_sync("L1")
+    _say(http_copy, "from http")
+    sqlite_utils._save_lead_sync(http_copy)
+    _say(ws_copy, "ws one", "ws two")
+    sqlite_utils._save_lead_sync(ws_copy)
+
+    texts = [m.text for m in sqlite_utils._get_lead_sync("L1").conversation_history]
+    assert texts == ["hi", "hello", "from http", "ws one", "ws two"]
@@ -0,0 +1,17 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def test_app_imports_offline_without_a_key(tmp_path):
+    # A fresh interpreter: this session's `main` was imported with a key set
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    env.update(EMBED_BACKEND="local", EMBED_STORE_DIR=str(tmp_path / "embeddings"))
+    script = f"import sys; sys.path.insert(0, {ROOT!r}); import main; assert main.client is None"
+
+    result = subprocess.run([sys.executable, "-c", script], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=120)
+
+    assert result.returncode == 0, result.stderr